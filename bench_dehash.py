@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import dehash
+
+SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+def parse_size(text):
+    """Parse a size like 512K, 10M or 1G into a number of bytes."""
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+class LogGenerator:
+    """Generator of substrate/txpool-like log lines. A relay chain and a
+    parachain import blocks (sometimes forking off the parent of the best
+    block), the transaction pool maintains its views on every new block and
+    transactions are submitted, propagated and included in blocks, so long
+    and short hashes of the same blocks and transactions recur throughout the
+    log, densely on some lines."""
+    def __init__(self, seed=0, fork_rate=0.05, pool_size=4096):
+        self.random = random.Random(seed)
+        self.fork_rate = fork_rate
+        self.pool_size = pool_size
+        self.time = 0.0
+        self.chains = {'🏆': [self.long_hash()], '[Parachain] 🏆': [self.long_hash()], '[Relaychain] 🆕': [self.long_hash()]}
+        self.numbers = {tag: 0 for tag in self.chains}
+        self.transactions = [self.long_hash() for _ in range(pool_size)]
+
+    def long_hash(self):
+        return f"0x{self.random.getrandbits(256):064x}"
+
+    def transaction(self):
+        """A transaction of the pool; new ones keep replacing included ones."""
+        index = self.random.randrange(self.pool_size)
+        if self.random.random() < 0.05:
+            self.transactions[index] = self.long_hash()
+        return self.transactions[index]
+
+    def timestamp(self):
+        self.time += self.random.expovariate(200)
+        seconds = int(self.time)
+        return f"2024-06-11 {21 + seconds // 3600 % 3:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}.{int(self.time * 1000) % 1000:03d}"
+
+    def import_block(self, tag):
+        """Import a block on one of the chains. The parent is the best block,
+        or, for a fork, its parent."""
+        blocks = self.chains[tag]
+        if len(blocks) > 1 and self.random.random() < self.fork_rate:
+            parent = blocks[-2]
+        else:
+            parent = blocks[-1]
+            self.numbers[tag] += 1
+        child = self.long_hash()
+        blocks.append(child)
+        del blocks[:-16]
+        return f"{self.timestamp()}  INFO tokio-runtime-worker substrate: {tag} Imported #{self.numbers[tag]} ({dehash.generate_short_hash(parent)} → {dehash.generate_short_hash(child)})    \n", child
+
+    def lines(self):
+        """Generate log lines forever."""
+        tag = '🏆'
+        while True:
+            line, block = self.import_block(self.random.choice(list(self.chains)))
+            yield line
+            best = self.chains[tag][-1]
+            yield f"{self.timestamp()}  INFO tokio-runtime-worker txpool: maintain: txs:(0, {self.pool_size}) views:[1;[({self.numbers[tag]}, 0, {self.pool_size})]] event:NewBestBlock {{ hash: {best}, tree_route: None }}  took:122.731µs    \n"
+            yield f"{self.timestamp()} DEBUG tokio-runtime-worker txpool: substrate_test_runtime_transaction_pool: add_block: {self.numbers[tag]} {best} included:{self.random.randrange(64)}\n"
+            for _ in range(self.random.randrange(20, 60)):
+                kind = self.random.random()
+                if kind < 0.4:
+                    yield f"{self.timestamp()} DEBUG tokio-runtime-worker txpool: [{self.transaction()}] ValidatedPool::submit_at\n"
+                elif kind < 0.6:
+                    short_hashes = ', '.join(dehash.generate_short_hash(self.transaction()) for _ in range(self.random.randrange(2, 12)))
+                    yield f"{self.timestamp()}  INFO tokio-runtime-worker sc_basic_authorship::basic_authorship: 🎁 Prepared block for proposing at {self.numbers[tag]} [{short_hashes}]\n"
+                elif kind < 0.8:
+                    yield f"{self.timestamp()} DEBUG tokio-runtime-worker txpool: [{dehash.generate_short_hash(self.transaction())}] propagated to peers, at {dehash.generate_short_hash(best)}\n"
+                elif kind < 0.9:
+                    yield f"{self.timestamp()} TRACE tokio-runtime-worker txpool: update_view_with_fork: {self.transaction()} {self.transaction()} {self.transaction()}\n"
+                else:
+                    yield f"{self.timestamp()}  INFO tokio-runtime-worker substrate: 💤 Idle (8 peers), best: #{self.numbers[tag]} ({dehash.generate_short_hash(best)})\n"
+
+def generate_log(path, size, seed=0):
+    """Write a generated log of roughly size bytes (whole lines) to the path."""
+    written = 0
+    with open(path, 'w') as log_file:
+        lines = LogGenerator(seed).lines()
+        while written < size:
+            chunk = ''.join(next(lines) for _ in range(1024))
+            log_file.write(chunk)
+            written += len(chunk.encode())
+    return written
+
+def peak_rss():
+    """Peak resident set size (in kB) of this process and its finished
+    children, e.g. worker processes."""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def time_stages(log_path, work_dir):
+    """Dehash a copy of the log with process_file and one job, recording the
+    stages with dehash.record_stats, so the stages timed are those of the
+    code actually run: stripping control characters, the scan, the rules of
+    every guard, building the dictionary, the rewrite pass and writing the
+    .dict file. Returns the seconds of every stage and the number of hashes.
+    The stages of single rules only count matches and are left out."""
+    file_path = os.path.join(work_dir, "stages.log")
+    shutil.copyfile(log_path, file_path)
+    with dehash.record_stats() as stats, contextlib.redirect_stderr(io.StringIO()):
+        dehash.process_file(file_path, False, dehash.HashToWord())
+    stages = {name: record['seconds'] for name, record in stats.stages.items() if not re.match(r'rule \d', name)}
+    return stages, stats.stages['dictionary file']['matches']
+
+def time_process_file(log_path, work_dir, jobs):
+    """Time process_file on a copy of the log (the copy is not timed)."""
+    file_path = os.path.join(work_dir, f"process_file-{jobs}.log")
+    shutil.copyfile(log_path, file_path)
+    start = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        dehash.process_file(file_path, False, dehash.HashToWord(), jobs=jobs)
+    return time.perf_counter() - start
+
+def run_in_child(func, *args):
+    """Run the function in a fresh (non-daemonic, so it can start worker
+    processes) process, so its peak RSS is its own. Returns the result of the
+    function and the peak RSS."""
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=measure, args=(sender, func, args))
+    process.start()
+    sender.close()
+    try:
+        outcome, value = receiver.recv()
+    except EOFError:
+        outcome, value = False, f"benchmark process exited with {process.exitcode}"
+    process.join()
+    if not outcome:
+        raise RuntimeError(value)
+    return value
+
+def measure(sender, func, args):
+    try:
+        result = func(*args)
+        sender.send((True, (result, peak_rss())))
+    except BaseException as error:
+        sender.send((False, repr(error)))
+        raise
+
+def run_benchmark(log_path, work_dir, jobs_list=(1,)):
+    """Benchmark dehashing the log: the stages of a serial run, then
+    process_file with every number of jobs. Returns a JSON-able result."""
+    size = os.path.getsize(log_path)
+    megabytes = size / SIZE_UNITS['M']
+    (stages, hashes), stages_rss = run_in_child(time_stages, log_path, work_dir)
+    result = {
+        'log': os.path.basename(log_path),
+        'size': size,
+        'hashes': hashes,
+        'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+        'stages_peak_rss_kb': stages_rss,
+        'process_file': [],
+    }
+    for jobs in jobs_list:
+        seconds, rss = run_in_child(time_process_file, log_path, work_dir, jobs)
+        result['process_file'].append({
+            'jobs': jobs,
+            'seconds': round(seconds, 4),
+            'throughput_mb_s': round(megabytes / seconds, 2),
+            'peak_rss_kb': rss,
+        })
+    return result
+
+def print_result(result, file=None):
+    file = file or sys.stdout
+    print(f"{result['log']}: {result['size'] / SIZE_UNITS['M']:.1f} MB, {result['hashes']} hashes", file=file)
+    for name, seconds in result['stages'].items():
+        print(f"  {name:<24} {seconds:9.3f} s", file=file)
+    print(f"  {'peak RSS':<24} {result['stages_peak_rss_kb'] / 1024:9.1f} MB", file=file)
+    for run in result['process_file']:
+        print(f"  process_file -j {run['jobs']:<3} {run['seconds']:9.3f} s {run['throughput_mb_s']:9.2f} MB/s {run['peak_rss_kb'] / 1024:9.1f} MB peak RSS", file=file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark dehash.py on generated substrate/txpool logs.')
+    parser.add_argument('--sizes', type=str, default='10M', help='Comma-separated sizes of the generated logs, e.g. 10M,100M,1G.')
+    parser.add_argument('-j', '--jobs', type=str, default='1', help='Comma-separated numbers of jobs to run process_file with.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the log generator.')
+    parser.add_argument('--work-dir', type=str, help='Directory for the generated logs, which are kept and reused (defaults to a temporary directory).')
+    parser.add_argument('--json', type=str, help="Write the results as JSON to this file, '-' writes to the standard output.")
+    parser.add_argument('--generate', type=str, metavar='PATH', help='Only generate a log of the first size to this path.')
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    if args.generate:
+        generate_log(args.generate, sizes[0], args.seed)
+        sys.exit(0)
+
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(work_dir, exist_ok=True)
+        results = []
+        for size in sizes:
+            log_path = os.path.join(work_dir, f"generated-{format_size(size)}-{args.seed}.log")
+            if not os.path.exists(log_path):
+                generate_log(log_path, size, args.seed)
+            result = run_benchmark(log_path, work_dir, [int(jobs) for jobs in args.jobs.split(',')])
+            results.append(result)
+            print_result(result, sys.stderr if args.json == '-' else sys.stdout)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
@@ -1,16 +1,45 @@
 #!/usr/bin/env python3
 
 import argparse
+import binascii
+import collections
+import collections.abc
+import contextlib
+import glob
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import lzma
+import mmap
+import multiprocessing
 import time
 import re
 import os
 import shutil
+import signal
 import random
-import nltk
-from nltk.corpus import words
+import struct
+import sys
+import tempfile
 
-# Ensure the nltk words corpus is downloaded
-nltk.download('words')
+LONG_HASH_PATTERN = r'0x[0-9a-f]{64}'
+SHORT_HASH_PATTERN = r'0x[0-9a-f]{4}…[0-9a-f]{4}'
+DOT_EDGE_PATTERN = r'Imported #(\d+) \((\w+) → (\w+)\)'
+ANSI_ESCAPE_PATTERN = r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'
+CONTROL_CHAR_PATTERN = r'[\x00-\x08\x0B-\x1F\x7F-\x9F]'
+CONTROL_CHARS = frozenset(chr(code) for code in [*range(0x00, 0x09), *range(0x0B, 0x20), *range(0x7F, 0xA0)])
+# The same control characters in UTF-8: single bytes, and \xc2\x80 to \xc2\x9f
+# for the C1 ones
+ASCII_CONTROL_BYTES = [bytes([code]) for code in [*range(0x00, 0x09), *range(0x0B, 0x20), 0x7F]]
+CONTROL_BYTES_PATTERN = rb'[\x00-\x08\x0B-\x1F\x7F]|\xc2[\x80-\x9f]'
+
+# Approximate size (in characters) of the chunks of whole lines processed at
+# once when streaming
+STREAM_CHUNK_SIZE = 1 << 20
+# Approximate size (in bytes) of the chunks processed by every worker process
+PARALLEL_CHUNK_SIZE = 8 << 20
 
 # Predefined replacement rules
 specific_replacements = []
@@ -40,6 +69,35 @@ add_specific_replacement(
         "add_block"
 )
 
+def load_rules(rules_path):
+    """Add the replacement rules of a JSON rules file: a list of objects with
+    the "pattern" (capturing the block number and the hash), the
+    "replacement" prefix and the "guard", like add_specific_replacement.
+    Rules sharing a guard are matched together, see RuleMatcher."""
+    for pattern, replacement, guard in read_rules(rules_path):
+        add_specific_replacement(pattern, replacement, guard)
+
+def read_rules(rules_path):
+    """Read the (pattern, replacement, guard) rules of a JSON rules file, see
+    load_rules. Guards must be plain text, see is_literal_guard, so that they
+    are found by the single scanning pass."""
+    with open(rules_path, 'r') as rules_file:
+        rules = json.load(rules_file)
+    parsed_rules = []
+    for number, rule in enumerate(rules, 1):
+        try:
+            pattern, replacement, guard = rule['pattern'], rule['replacement'], rule['guard']
+            groups = re.compile(pattern).groups
+        except (KeyError, TypeError, re.error) as error:
+            raise ValueError(f"{rules_path}: invalid rule {number}: {error!r}") from error
+        if groups < 2:
+            raise ValueError(f"{rules_path}: rule {number} must capture the block number and the hash")
+        if not isinstance(guard, str) or not is_literal_guard(guard):
+            raise ValueError(f"{rules_path}: the guard of rule {number} must be plain text, with no regex syntax "
+                             f"and no start of a hash, got {guard!r}")
+        parsed_rules.append((pattern, replacement, guard))
+    return parsed_rules
+
 def filter_and_findall(content, guard_pattern, find_pattern):
     """Filter lines by guard pattern and find all matches of find pattern. This
     is to pre-filter content before using regex."""
@@ -71,167 +129,2603 @@ def create_backup(file_path):
     # print(f"Backup created at {backup_path}")
 
 
-def get_words(length):
-    """Get a shuffled list of four to six letter words."""
-    new_words = list({word.upper() for word in words.words() if len(word) == length})
-    random.shuffle(new_words)
-    return new_words
+# Number of words of one length tried for a hash before trying longer words,
+# see WordPool.hashed_word
+HASHED_WORD_PROBES = 8
+# Number of words in every bucket of the built-in fallback table
+FALLBACK_BUCKET_SIZE = 4096
+FALLBACK_CONSONANTS = "BDFGHKLMNPRSTVZ"
+FALLBACK_VOWELS = "AEIOU"
+# Words that already mean something in a log (log levels, words of log
+# messages, acronyms), which are never handed out to hashes. Otherwise a
+# dehashed log could not be told apart from the log text, e.g. by --reverse.
+LOG_WORDS = frozenset("""
+    TRACE DEBUG INFO NOTICE WARN WARNING ERROR ERR FATAL CRIT CRITICAL ALERT PANIC EMERG
+    NODE NODES TIME TIMEOUT DONE BASE SIZE MODE FINE LATE EARLY BEST IDLE SYNC SYNCED PEER PEERS
+    BLOCK BLOCKS RBLOCK HASH HASHES HEAD HEADER TIP FORK CHAIN STATE VIEW VIEWS POOL TXPOOL NEW OLD
+    READY START STARTED STOP STOPPED OPEN CLOSE CLOSED FAIL FAILED PASS PASSED OKAY TRUE FALSE NONE NULL NIL
+    SOME EMPTY FULL LIMIT RETRY ABORT EXIT KILL DEAD ALIVE LIVE BUSY WAIT SENT RECV READ WRITE LOAD SAVE
+    IMPORT IMPORTED FINAL EVENT TASK JOB WORKER THREAD MAIN ROOT USER HOST PORT PATH FILE DATA INPUT OUTPUT
+    UTC GMT API RPC HTTP HTTPS JSON TCP UDP DNS TLS SSL URL URI UUID CPU RAM DISK NET
+    GRANDPA BEEFY BABE AURA TODO FIXME NOTE
+""".split())
+
+def word_table_path():
+    """Path of the word table: $DEHASH_WORD_TABLE, or a file in the user's
+    cache directory."""
+    if os.environ.get('DEHASH_WORD_TABLE'):
+        return os.environ['DEHASH_WORD_TABLE']
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'dehash', 'words.tbl')
+
+def build_word_table(download=False):
+    """Build the word table buckets from the nltk words corpus. The corpus is
+    only downloaded if asked to, otherwise it must be installed already."""
+    import nltk
+    from nltk.corpus import words
+    if download:
+        nltk.download('words')
+
+    buckets = collections.defaultdict(list)
+    for word in {word.upper() for word in words.words() if word.isalpha()}:
+        buckets[len(word)].append(word)
+    return {length: ''.join(sorted(bucket)) for length, bucket in buckets.items()}
+
+def write_word_table(path, buckets):
+    """Write the word table: one line per bucket with the word length and all
+    the words of that length concatenated."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", 'w') as table_file:
+        for length, bucket in sorted(buckets.items()):
+            table_file.write(f"{length} {bucket}\n")
+    os.replace(path + ".tmp", path)
+
+def read_word_table(path):
+    """Read the word table buckets written by write_word_table."""
+    buckets = {}
+    with open(path, 'r') as table_file:
+        for line in table_file:
+            length, bucket = line.rstrip('\n').split(' ', 1)
+            buckets[int(length)] = bucket
+    return buckets
+
+def fallback_bucket(length):
+    """Made-up, pronounceable words (consonants and vowels taking turns) for
+    lengths missing from the word table, or when there is no table at all."""
+    sizes = [len(FALLBACK_CONSONANTS) if position % 2 == 0 else len(FALLBACK_VOWELS) for position in range(length)]
+    space = 1
+    for size in sizes:
+        space *= size
+    indexes = random.Random(f"fallback:{length}").sample(range(space), min(space, FALLBACK_BUCKET_SIZE))
+
+    bucket = []
+    for index in sorted(indexes):
+        word = []
+        for position in range(length):
+            index, letter = divmod(index, sizes[position])
+            word.append((FALLBACK_CONSONANTS if position % 2 == 0 else FALLBACK_VOWELS)[letter])
+        bucket.append(''.join(word))
+    return ''.join(bucket)
+
+def without_log_words(bucket, length):
+    """The bucket of words of the length without the LOG_WORDS."""
+    log_words = {word for word in LOG_WORDS if len(word) == length}
+    if not log_words:
+        return bucket
+    words = (bucket[index:index + length] for index in range(0, len(bucket), length))
+    return ''.join(word for word in words if word not in log_words)
+
+class WordTable:
+    """Words bucketed by length. Every bucket is a single string of the
+    concatenated words of that length, so the table is a handful of strings
+    rather than hundreds of thousands of objects, and the word at an index is
+    a slice of it. LOG_WORDS are left out of every bucket when it is first
+    used."""
+    def __init__(self, buckets):
+        self.buckets = dict(buckets)
+        self.filtered = set()
+
+    def bucket(self, length):
+        if length not in self.filtered:
+            self.buckets[length] = without_log_words(self.buckets.get(length) or fallback_bucket(length), length)
+            self.filtered.add(length)
+        return self.buckets[length]
+
+    def size(self, length):
+        return len(self.bucket(length)) // length
+
+    def word(self, length, index):
+        return self.bucket(length)[index * length:(index + 1) * length]
+
+# The word table, loaded on first use, see get_word_table
+word_table = None
+
+def get_word_table():
+    """Get the word table. It is read from word_table_path, or built there
+    once from the locally installed nltk words corpus. Without both, the
+    built-in fallback words are used, and an empty table is written to
+    remember it, as importing nltk to find no corpus takes longer than most
+    runs: --build-word-table builds it for real. Nothing is ever downloaded
+    here."""
+    global word_table
+    if word_table is None:
+        path = word_table_path()
+        if os.path.exists(path):
+            word_table = WordTable(read_word_table(path))
+        else:
+            try:
+                buckets = build_word_table()
+            except (ImportError, LookupError):
+                buckets = {}
+            try:
+                write_word_table(path, buckets)
+            except OSError:
+                pass
+            word_table = WordTable(buckets)
+    return word_table
+
+class WordPool:
+    """Words handed out to hashes: drawn without repetition from the word
+    table, shortest first, in an order shuffled by the seed. Only the bucket
+    in use is shuffled, and only its indexes. Words appended to the pool are
+    handed out first, the last appended first.
 
-# The list of generated words and a current word size used
-current_word_size = 4
-generated_words = get_words(current_word_size)
+    With a namespace, words are not drawn in order but derived from the
+    hashes, see hashed_word."""
+    def __init__(self, seed=None, namespace=None):
+        self.reset(seed, namespace)
+
+    def reset(self, seed=None, namespace=None):
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.namespace = namespace
+        self.word_size = 4
+        self.position = 0
+        self.order = None
+        self.appended = []
+
+    def append(self, word):
+        self.appended.append(word)
+
+    def state(self):
+        """Get the state of the pool, to continue it later with restore."""
+        return {
+            'seed': self.seed,
+            'namespace': self.namespace,
+            'word_size': self.word_size,
+            'position': self.position,
+            'appended': list(self.appended),
+        }
+
+    def restore(self, state):
+        self.reset(state['seed'], state['namespace'])
+        self.word_size = state['word_size']
+        self.position = state['position']
+        self.appended = list(state['appended'])
+
+    def generate(self, h=None, taken=()):
+        """Generate a word for the hash, which must not be one of the taken
+        words if it is derived from the hash."""
+        if self.appended:
+            return self.appended.pop()
+        if self.namespace is not None and h is not None:
+            return self.hashed_word(h, taken)
+
+        table = get_word_table()
+        while self.position >= table.size(self.word_size):
+            self.word_size += 1
+            self.position = 0
+            self.order = None
+        if self.order is None:
+            self.order = list(range(table.size(self.word_size)))
+            random.Random(f"{self.seed}:{self.word_size}").shuffle(self.order)
+
+        index = self.order[self.position]
+        self.position += 1
+        return table.word(self.word_size, index)
+
+    def hashed_word(self, h, taken):
+        """Derive the word of the hash from a keyed hash of it, so it is the
+        same in every run and every process using the same namespace. If the
+        word is taken, a few more words of the same length are probed, then
+        longer words. Only then does the word depend on the words assigned
+        before it."""
+        key = hashlib.blake2b(str(self.namespace).encode()).digest()
+        value = int.from_bytes(hashlib.blake2b(h.encode(), key=key, digest_size=16).digest(), 'big')
+
+        table = get_word_table()
+        length = 4
+        while True:
+            size = table.size(length)
+            start = value % size
+            step = 1 + (value >> 64) % max(size - 1, 1)
+            for probe in range(HASHED_WORD_PROBES):
+                word = table.word(length, (start + probe * step) % size)
+                if word not in taken:
+                    return word
+            length += 1
+
+# The pool of words used by generate_word
+word_pool = WordPool()
+
+def seed_words(seed, namespace=None):
+    """Restart the pool of generated words with a seeded shuffle, so the same
+    hashes get the same words in every run. With a namespace, the words are
+    derived from the hashes instead, see WordPool.hashed_word."""
+    word_pool.reset(seed, namespace)
 
 def append_word_to_dictionary(word):
-    global generated_words
-    generated_words.append(word)
-
-def generate_word():
-    """Generate a four-letter word from the pre-fetched list."""
-    global generated_words
-    if len(generated_words) == 0:
-        global current_word_size
-        current_word_size = current_word_size + 1
-        generated_words = get_words(current_word_size)
-    return generated_words.pop()
+    word_pool.append(word)
+
+def generate_word(h=None, taken=()):
+    """Generate a word from the pool, four-letter words first."""
+    return word_pool.generate(h, taken)
 
 def generate_short_hash(long_hash):
     """Generate a short hash from a long hash."""
     return f"0x{long_hash[2:6]}…{long_hash[-4:]}"
 
-def replace_hashes(content, initial_hash_to_word):
-    """Build dictionary and replace hashes in the content."""
-    start_time = time.time()
-    long_hashes = re.findall(r'0x[0-9a-f]{64}', content)
-    short_hashes = re.findall(r'0x[0-9a-f]{4}…[0-9a-f]{4}', content)
-    # print(f"1 Execution time: {time.time() - start_time}")
+class WordIndex(dict):
+    """Word-to-hash index of HashToWord. Words of its base dictionary count
+    as taken too."""
+    def __init__(self, base=None):
+        super().__init__()
+        self.base = base
 
-    # Create a dictionary to map short hashes to words
-    hash_to_word = initial_hash_to_word
+    def __contains__(self, word):
+        return dict.__contains__(self, word) or (self.base is not None and self.base.has_word(word))
 
-    start_time = time.time()
-    for (pattern, replacement_prefix, guard) in specific_replacements:
-        match_start_time = time.time()
-        matches = filter_and_findall(content, guard, pattern)
-        # print(f"X Execution time: {time.time() - match_start_time}")
+class HashToWord(dict):
+    """The hash-to-word dictionary with a word-to-hash index, so checking if a
+    word is already taken does not scan all the values. It also remembers the
+    last fork suffix used for every BLOCK name, see fork_word.
 
-        for match in matches:
-            # print("found match:",match)
-            number = match[0]
-            h = match[1]
-            if len(h) == 66:
-                h = generate_short_hash(h)
+    The dictionary is keyed by short hashes. The full hash behind a short
+    hash is kept too, once a long hash was seen, as 32 bytes in full_hashes.
+    Long hashes colliding with it (same short hash, different full hash) get
+    words of their own, kept in collisions by their full hash.
 
-            if h not in hash_to_word:
-                replacement_word = f"{replacement_prefix}{number}"
+    The dictionary can be layered over a read-only base dictionary, e.g. a
+    memory-mapped MappedDictionary, which is only looked up and never loaded.
+    Entries added later are kept in memory and come after the base entries."""
+    def __init__(self, *args, base=None, **kwargs):
+        super().__init__()
+        self.base = base
+        self.word_to_hash = WordIndex(base)
+        self.fork_suffixes = {}
+        self.full_hashes = {}
+        self.collisions = dict(base.collisions()) if base is not None else {}
+        # Base entries already looked up, see __missing__
+        self.base_cache = {}
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, h, word):
+        if dict.__contains__(self, h):
+            self.unindex(h)
+        super().__setitem__(h, word)
+        self.word_to_hash.setdefault(word, h)
+
+    def __delitem__(self, h):
+        self.unindex(h)
+        self.full_hashes.pop(h, None)
+        super().__delitem__(h)
+
+    def __missing__(self, h):
+        if self.base is None:
+            raise KeyError(h)
+        if h not in self.base_cache:
+            self.base_cache[h] = self.base[h]
+        return self.base_cache[h]
+
+    def __contains__(self, h):
+        return dict.__contains__(self, h) or (self.base is not None and h in self.base)
+
+    def __len__(self):
+        return dict.__len__(self) + (len(self.base) if self.base is not None else 0)
+
+    def __iter__(self):
+        return (h for h, word in self.items())
+
+    def __reduce__(self):
+        return (restore_hash_to_word, (dict(dict.items(self)), self.base, self.full_hashes, self.collisions))
+
+    def get(self, h, default=None):
+        return self[h] if h in self else default
+
+    def keys(self):
+        return iter(self)
+
+    def copy(self):
+        """Copy the dictionary, sharing its base."""
+        return restore_hash_to_word(dict(dict.items(self)), self.base, self.full_hashes, self.collisions)
+
+    def full_hash(self, short_hash):
+        """Get the full hash (32 bytes) behind the short hash, if known."""
+        full_hash = self.full_hashes.get(short_hash)
+        if full_hash is None and self.base is not None and not dict.__contains__(self, short_hash):
+            full_hash = self.base.full_hash(short_hash)
+        return full_hash
+
+    def add_collision(self, full_hash, word):
+        """Add the word of a long hash whose short hash stands for another
+        full hash."""
+        self.collisions[full_hash] = word
+        self.word_to_hash.setdefault(word, '0x' + full_hash.hex())
+
+    def add_entry(self, h, word):
+        """Add an entry of a dictionary file, whose hash is either a short
+        hash or a full hash."""
+        if len(h) != 66:
+            self[h] = word
+            return
+        short_hash = generate_short_hash(h)
+        full_hash = bytes.fromhex(h[2:])
+        if short_hash not in self or (self.full_hash(short_hash) is None and self[short_hash] == word):
+            self[short_hash] = word
+            self.full_hashes[short_hash] = full_hash
+        elif self.full_hash(short_hash) != full_hash:
+            self.add_collision(full_hash, word)
+
+    def entries(self):
+        """The (hash, word) entries of the dictionary, the hash being the full
+        hash where it is known, see write_text_dictionary."""
+        for short_hash, word in self.items():
+            full_hash = self.full_hash(short_hash)
+            yield ('0x' + full_hash.hex() if full_hash is not None else short_hash), word
+        for full_hash, word in self.collisions.items():
+            yield '0x' + full_hash.hex(), word
+
+    def ambiguous_short_hashes(self):
+        """Short hashes standing for more than one full hash."""
+        return {generate_short_hash('0x' + full_hash.hex()) for full_hash in self.collisions}
+
+    def items(self):
+        if self.base is None:
+            return dict.items(self)
+        return itertools.chain(
+            ((h, word) for h, word in self.base.items() if not dict.__contains__(self, h)),
+            dict.items(self))
+
+    def unindex(self, h):
+        word = dict.__getitem__(self, h)
+        if dict.get(self.word_to_hash, word) == h:
+            del self.word_to_hash[word]
+            other = next((other for other, other_word in dict.items(self) if other_word == word and other != h), None)
+            if other is not None:
+                self.word_to_hash[word] = other
+        # A freed word may make a lower fork suffix available again
+        self.fork_suffixes.clear()
+
+    def update(self, *args, **kwargs):
+        for h, word in dict(*args, **kwargs).items():
+            self[h] = word
+
+    def setdefault(self, h, word=None):
+        if h not in self:
+            self[h] = word
+        return self[h]
+
+    def fork_word(self, replacement_word):
+        """Get the replacement word, or if it is taken, the first of its fork
+        variants (e.g. BLOCK12f01, BLOCK12f02) that is not. Words are only
+        ever added, so the search resumes from the last suffix used."""
+        if replacement_word not in self.word_to_hash:
+            return replacement_word
+
+        suffix = self.fork_suffixes.get(replacement_word, 1)
+        final_word = f"{replacement_word}f{suffix:02d}"
+        while final_word in self.word_to_hash:
+            suffix += 1
+            final_word = f"{replacement_word}f{suffix:02d}"
+        self.fork_suffixes[replacement_word] = suffix
+        return final_word
+
+def restore_hash_to_word(entries, base, full_hashes, collisions):
+    hash_to_word = HashToWord(entries, base=base)
+    hash_to_word.full_hashes.update(full_hashes)
+    for full_hash, word in collisions.items():
+        hash_to_word.add_collision(full_hash, word)
+    return hash_to_word
+
+def report_dictionary(hash_to_word, file=None):
+    """Print the size of the dictionary and how many short hashes in it are
+    ambiguous."""
+    file = file or sys.stderr
+    print(f"hash_to_word count: {len(hash_to_word)}", file=file)
+    ambiguous = hash_to_word.ambiguous_short_hashes()
+    if ambiguous:
+        print(f"ambiguous short hashes: {len(ambiguous)} ({len(hash_to_word.collisions)} colliding long hashes)", file=file)
+
+class Stats:
+    """Wall time, size of the content (in characters) and match counts of the
+    stages of dehashing: stripping control characters, the scan for hashes
+    and rule guards, the replacement rules of every guard, building the
+    dictionary (words of the rules, generated words), the rewrite pass and
+    writing the dictionary file. The matches are what the stage found: the
+    hashes seen for the first time (in the chunk of a worker process), the
+    control characters stripped, the rule matches, the words assigned and the
+    replacements made. The rules of a guard are matched, and timed, together;
+    every rule also has a stage of its own with only its matches. Stages run
+    by worker processes add up their times."""
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds, size=0, matches=0):
+        record = self.stages.setdefault(stage, {'seconds': 0.0, 'size': 0, 'matches': 0, 'calls': 0})
+        record['seconds'] += seconds
+        record['size'] += size
+        record['matches'] += matches
+        record['calls'] += 1
+
+    def merge(self, other):
+        for stage, other_record in other.stages.items():
+            record = self.stages.setdefault(stage, {'seconds': 0.0, 'size': 0, 'matches': 0, 'calls': 0})
+            for field, value in other_record.items():
+                record[field] += value
+
+    def to_json(self):
+        return {'stages': self.stages, 'seconds': sum(record['seconds'] for record in self.stages.values())}
+
+    def table(self):
+        """The stats as a table, one stage per line."""
+        total = sum(record['seconds'] for record in self.stages.values()) or 1.0
+        lines = [f"{'stage':<24} {'seconds':>9} {'share':>7} {'MB':>9} {'MB/s':>9} {'matches':>10} {'calls':>7}"]
+        for stage, record in self.stages.items():
+            megabytes = record['size'] / (1 << 20)
+            speed = f"{megabytes / record['seconds']:9.1f}" if record['size'] and record['seconds'] else f"{'':>9}"
+            lines.append(f"{stage:<24} {record['seconds']:9.3f} {100 * record['seconds'] / total:6.1f}% "
+                         f"{megabytes:9.1f} {speed} {record['matches']:10} {record['calls']:7}")
+        return '\n'.join(lines)
+
+# The stats recorded by the dehashing stages, if any, see record_stats
+stage_stats = None
+
+@contextlib.contextmanager
+def record_stats():
+    """Record the stats of all the dehashing done in the block:
+
+        with record_stats() as stats:
+            process_path("node.log", "node.dehashed.log", HashToWord())
+        print(stats.table())
+    """
+    global stage_stats
+    previous_stats, stage_stats = stage_stats, Stats()
+    try:
+        yield stage_stats
+    finally:
+        stage_stats = previous_stats
+
+def add_stats(stage, started, size=0, matches=0):
+    """Add the time since started to the stats of the stage."""
+    stage_stats.add(stage, time.perf_counter() - started, size, matches)
+
+class ScanState:
+    """Rule matches and hashes collected from the content. Only the first
+    occurrence of every hash is kept, which is all that is needed to build the
+    dictionary, so the state grows with the number of distinct hashes and not
+    with the size of the content.
+
+    Long hashes are kept by their short hash, with the first full hash (as 32
+    bytes) seen for it. Other full hashes with the same short hash are kept
+    in colliding_hashes. There is a dict of rule matches for every rule, of
+    the predefined rules by default."""
+    def __init__(self, rules=None):
+        self.rule_matches = [{} for _ in (specific_replacements if rules is None else rules)]
+        self.long_hashes = {}
+        self.short_hashes = {}
+        self.colliding_hashes = {}
+
+    def hash_count(self):
+        return len(self.long_hashes) + len(self.short_hashes) + len(self.colliding_hashes)
+
+    def add_long_hash(self, short_hash, full_hash):
+        if self.long_hashes.setdefault(short_hash, full_hash) != full_hash:
+            self.colliding_hashes.setdefault(full_hash, short_hash)
 
-                final_word = replacement_word
-                suffix = 1
+    def merge(self, other):
+        """Merge the state of the content that follows this state's content."""
+        for rule_matches, other_rule_matches in zip(self.rule_matches, other.rule_matches):
+            for h, number in other_rule_matches.items():
+                rule_matches.setdefault(h, number)
+        for short_hash, full_hash in other.long_hashes.items():
+            self.add_long_hash(short_hash, full_hash)
+        for full_hash, short_hash in other.colliding_hashes.items():
+            self.add_long_hash(short_hash, full_hash)
+        for short_hash in other.short_hashes:
+            self.short_hashes.setdefault(short_hash)
 
-                while final_word in hash_to_word.values():
-                    final_word = f"{replacement_word}f{suffix:02d}"
-                    suffix += 1
+class RuleMatcher:
+    """Matcher of the replacement rules sharing a guard, run on the lines
+    where the guard was found. A rule whose pattern starts with '.*' matches
+    at most once per line, at the start of it, so all such rules are matched
+    by one regex anchored at the start of the line, in which every rule is an
+    optional lookahead capturing its match. This also spares the regex engine
+    from retrying every rule at every position of the lines it does not
+    match. Other rules are run one by one."""
+    def __init__(self, rules, rule_indexes):
+        self.stage = f"rules {','.join(map(str, rule_indexes))} ({rules[rule_indexes[0]][2]})"
+        self.rule_stages = {index: f"rule {index} ({rules[index][1]})" for index in rule_indexes}
+        line_rules = [index for index in rule_indexes if rules[index][0].startswith('.*') and not rules[index][0].startswith(('.*?', '.*+'))]
+        self.line_rules = []
+        self.line_pattern = None
+        if line_rules:
+            alternatives = []
+            group = 1
+            for index in line_rules:
+                alternatives.append(f"(?:(?=({rules[index][0]}))|)")
+                self.line_rules.append((index, group))
+                group += 1 + re.compile(rules[index][0]).groups
+            try:
+                self.line_pattern = re.compile(''.join(alternatives))
+            except re.error:
+                # e.g. rules using the same group names
+                line_rules = []
+                self.line_rules = []
+        self.findall_rules = [(index, re.compile(rules[index][0])) for index in rule_indexes if index not in line_rules]
 
-                hash_to_word[h] = final_word
-    # print(f"2 Execution time: {time.time() - start_time}")
+    def find(self, lines, rule_matches):
+        """Collect the (hash, number) matches of the rules in the lines into
+        rule_matches, a dict per rule. Returns the number of matches of every
+        rule, by rule index."""
+        found_matches = dict.fromkeys(self.rule_stages, 0)
+        if self.line_pattern is not None:
+            for line in lines:
+                match = self.line_pattern.match(line)
+                for rule_index, group in self.line_rules:
+                    if match.group(group) is not None:
+                        found_matches[rule_index] += 1
+                        add_rule_match(rule_matches[rule_index], match.group(group + 1), match.group(group + 2))
+        for rule_index, rule_pattern in self.findall_rules:
+            for line in lines:
+                for match in rule_pattern.findall(line):
+                    found_matches[rule_index] += 1
+                    add_rule_match(rule_matches[rule_index], match[0], match[1])
+        return found_matches
 
-    start_time = time.time()
-    for long_hash in long_hashes:
-        short_hash = generate_short_hash(long_hash)
+    def add_find_stats(self, started, lines, found_matches):
+        """Add the stats of a find call: the time of all the rules together,
+        as they are matched together, and the matches of every rule."""
+        add_stats(self.stage, started, sum(len(line) for line in lines), sum(found_matches.values()))
+        for rule_index, matches in found_matches.items():
+            stage_stats.add(self.rule_stages[rule_index], 0.0, matches=matches)
+
+# Characters with a special meaning in a regex
+REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+def is_literal_guard(guard):
+    """Whether the guard is plain text, which can be found by the combined
+    regex of Scanner. It must not hold the start of a hash either, which the
+    guard would take from the hash regex."""
+    return bool(guard) and not REGEX_METACHARS.intersection(guard) and '0x' not in guard and not guard.endswith('0')
+
+def guards_overlap(guard, other):
+    """Whether the two guards can share characters where they are found,
+    e.g. 'Imported' and 'Imported #', or 'add_block' and 'block': the
+    combined regex of Scanner would then only find the first of them."""
+    return (guard in other or other in guard
+            or any(other.startswith(guard[start:]) for start in range(1, len(guard)))
+            or any(guard.startswith(other[start:]) for start in range(1, len(other))))
+
+def add_rule_match(rule_matches, number, h):
+    if len(h) == 66:
+        h = generate_short_hash(h)
+    rule_matches.setdefault(h, number)
+
+class Scanner:
+    """Single-pass matcher for the given replacement rules. One regex finds
+    long and short hashes, rule guards and (optionally) control characters, so
+    every chunk of content is walked once to scan it and once to rewrite it.
+    Rules are only run on the lines where their guard was found, see
+    RuleMatcher.
+
+    Every alternative of the combined regexes starts with a literal and has
+    no group around it, which lets the regex engine skip ahead to the
+    characters that can start a match. Matches are told apart by their text.
+
+    Only literal guards are found by the combined regex, see is_literal_guard,
+    and only those overlapping no other guard, see guards_overlap. Other
+    guards are searched for on every line, like filter_and_findall does, so
+    that anchors, guards running over a hash and overlapping guards keep
+    working."""
+    def __init__(self, rules, strip_control_chars):
+        self.guards = list(dict.fromkeys(guard for (pattern, replacement_prefix, guard) in rules))
+        self.rule_matchers = [RuleMatcher(rules, [index for index, rule in enumerate(rules) if rule[2] == guard]) for guard in self.guards]
+        literal_guards = [guard for guard in self.guards if is_literal_guard(guard)]
+        self.guard_index_by_text = {guard: index for index, guard in enumerate(self.guards) if guard in literal_guards
+                                    and not any(guards_overlap(guard, other) for other in literal_guards if other != guard)}
+        self.line_guards = [(index, re.compile(re.escape(guard) if guard in literal_guards else guard))
+                            for index, guard in enumerate(self.guards) if guard not in self.guard_index_by_text]
+
+        hashes = [LONG_HASH_PATTERN, SHORT_HASH_PATTERN]
+        control_chars = [re.escape(char) for char in CONTROL_CHARS] if strip_control_chars else []
+        self.scan_pattern = re.compile('|'.join(hashes + [re.escape(guard) for guard in self.guard_index_by_text] + control_chars))
+
+        # Tokens of the edge become \w+ once their hashes are replaced, see DOT_EDGE_PATTERN
+        token = rf'(?:{SHORT_HASH_PATTERN}|\w)+'
+        edge = rf'Imported #(\d+) \(({token}) → ({token})\)'
+        self.rewrite_pattern = re.compile('|'.join(hashes + [edge] + control_chars))
+        self.hash_pattern = re.compile('|'.join(hashes))
+
+    def guard_index(self, text):
+        """Find the (literal) guard that matched the text."""
+        return self.guard_index_by_text[text]
+
+    def strip_control_chars(self, content):
+        if stage_stats is None:
+            return remove_control_chars(content)
+        started = time.perf_counter()
+        stripped = remove_control_chars(content)
+        add_stats('control chars', started, len(content), len(content) - len(stripped))
+        return stripped
+
+    def scan(self, content, state):
+        """Collect rule matches and hashes from the content into the scan
+        state and return the content, stripped of control characters if the
+        scanner does that. Rules are run once the whole content is scanned, so
+        that content with control characters can still be rescanned after
+        stripping them."""
+        recording = stage_stats is not None
+        if recording:
+            started = time.perf_counter()
+            known_hashes = state.hash_count()
+        long_hashes = state.long_hashes
+        short_hashes = state.short_hashes
+        colliding_hashes = state.colliding_hashes
+        guarded_lines = [[] for _ in self.guards]
+        last_line_starts = {}
+
+        for match in self.scan_pattern.finditer(content):
+            text = match.group()
+            if text.startswith('0x'):
+                if len(text) == 66:
+                    short_hash = generate_short_hash(text)
+                    full_hash = bytes.fromhex(text[2:])
+                    if long_hashes.setdefault(short_hash, full_hash) != full_hash:
+                        colliding_hashes.setdefault(full_hash, short_hash)
+                else:
+                    short_hashes.setdefault(text)
+            elif text in CONTROL_CHARS:
+                if recording:
+                    found_hashes = state.hash_count() - known_hashes
+                    add_stats('scan', started, matches=found_hashes)
+                # Hashes found so far precede the first control character, so
+                # they are found again, in the same order, in the stripped content.
+                return self.scan(self.strip_control_chars(content), state)
+            else:
+                guard_index = self.guard_index(text)
+                line_start = content.rfind('\n', 0, match.start()) + 1
+                if last_line_starts.get(guard_index) != line_start:
+                    last_line_starts[guard_index] = line_start
+                    guarded_lines[guard_index].append(line_start)
+
+        if recording:
+            found_hashes = state.hash_count() - known_hashes
+            add_stats('scan', started, len(content), found_hashes)
+
+        for guard_index, guard_regex in self.line_guards:
+            line_start = 0
+            for line in content.split('\n'):
+                if guard_regex.search(line):
+                    guarded_lines[guard_index].append(line_start)
+                line_start += len(line) + 1
+
+        for guard_index, line_starts in enumerate(guarded_lines):
+            lines = []
+            for line_start in line_starts:
+                line_end = content.find('\n', line_start)
+                lines.append(content[line_start:] if line_end == -1 else content[line_start:line_end])
+            if not lines:
+                continue
+            if recording:
+                started = time.perf_counter()
+            found_matches = self.rule_matchers[guard_index].find(lines, state.rule_matches)
+            if recording:
+                self.rule_matchers[guard_index].add_find_stats(started, lines, found_matches)
+        return content
+
+    def rewrite(self, content, hash_to_word):
+        """Replace all known hashes in the content with their words. Returns
+        the new content and the (number, parent, child) edges of its Imported
+        lines."""
+        if stage_stats is not None:
+            started = time.perf_counter()
+        collisions = getattr(hash_to_word, 'collisions', None)
+
+        def word(h):
+            if len(h) != 66:
+                return hash_to_word[h]
+            if collisions:
+                colliding_word = collisions.get(bytes.fromhex(h[2:]))
+                if colliding_word is not None:
+                    return colliding_word
+            return hash_to_word[generate_short_hash(h)]
+
+        def replace_token(match):
+            return word(match.group())
+
+        parts = []
+        edges = []
+        last_end = 0
+        last_edge_line_start = -1
+
+        for match in self.rewrite_pattern.finditer(content):
+            text = match.group()
+            start, end = match.span()
+            parts.append(content[last_end:start])
+            last_end = end
+            if match.lastindex:
+                parent = self.hash_pattern.sub(replace_token, match.group(2))
+                child = self.hash_pattern.sub(replace_token, match.group(3))
+                parts.append(f"Imported #{match.group(1)} ({parent} → {child})")
+                # Only the first edge of every line is taken, like in find_dot_edges
+                line_start = content.rfind('\n', 0, start) + 1
+                if line_start != last_edge_line_start:
+                    last_edge_line_start = line_start
+                    edges.append((int(match.group(1)), parent, child))
+            elif text.startswith('0x'):
+                parts.append(word(text))
+            else:
+                if stage_stats is not None:
+                    add_stats('rewrite', started)
+                return self.rewrite(self.strip_control_chars(content), hash_to_word)
+
+        parts.append(content[last_end:])
+        if stage_stats is not None:
+            add_stats('rewrite', started, len(content), len(parts) // 2)
+        return ''.join(parts), edges
+
+control_bytes_regex = re.compile(ANSI_ESCAPE_PATTERN.encode() + b'|' + CONTROL_BYTES_PATTERN)
+c1_control_bytes_regex = re.compile(rb'\xc2[\x80-\x9f]')
+
+def has_control_bytes(data, start, end):
+    """Whether the range of the UTF-8 data has control characters. Looking
+    for every byte with find is much faster than matching a character class
+    with a regex."""
+    return (any(data.find(control_byte, start, end) != -1 for control_byte in ASCII_CONTROL_BYTES)
+            or c1_control_bytes_regex.search(data, start, end) is not None)
+
+class BytesScanner(Scanner):
+    """Scanner working on the UTF-8 encoded content, e.g. a memory-mapped
+    file, without decoding it. The same regexes are matched as bytes ('…'
+    and '→' being literal UTF-8 sequences), only the matched hashes and the
+    lines with a guard (for the rules) are decoded, and the rewritten content
+    is built from the untouched byte ranges between the matches. Both passes
+    work on the [start, end) range of the content, which should be whole
+    lines.
+
+    Like Scanner, content with control characters is stripped and scanned
+    again, so a lone carriage return is dropped where text mode would have
+    read it as a newline. Control characters are looked for before the
+    regexes are run, see has_control_bytes, which keeps them out of the
+    regexes."""
+    def __init__(self, rules, strip_control_chars):
+        super().__init__(rules, strip_control_chars)
+        self.strips_control_chars = strip_control_chars
+        hashes = [LONG_HASH_PATTERN.encode(), SHORT_HASH_PATTERN.encode()]
+        self.scan_pattern = re.compile(b'|'.join(hashes + [re.escape(guard).encode() for guard in self.guard_index_by_text]))
+        self.line_guards = [(index, re.compile(guard_regex.pattern.encode())) for index, guard_regex in self.line_guards]
+
+        token = rf'(?:{SHORT_HASH_PATTERN}|\w)+'
+        edge = rf'Imported #(\d+) \(({token}) → ({token})\)'.encode()
+        self.rewrite_pattern = re.compile(b'|'.join(hashes + [edge]))
+        self.hash_pattern = re.compile(b'|'.join(hashes))
+
+    def stripped_range(self, data, start, end):
+        """The data and range to work on: the range itself, or if it has
+        control characters to strip, a stripped copy of it."""
+        if end is None:
+            end = len(data)
+        if self.strips_control_chars and has_control_bytes(data, start, end):
+            data = self.strip_control_chars(data[start:end])
+            return data, 0, len(data)
+        return data, start, end
+
+    def strip_control_chars(self, content):
+        if stage_stats is None:
+            return control_bytes_regex.sub(b'', content)
+        started = time.perf_counter()
+        stripped = control_bytes_regex.sub(b'', content)
+        add_stats('control chars', started, len(content), len(content) - len(stripped))
+        return stripped
+
+    def scan(self, data, state, start=0, end=None):
+        """Collect rule matches and hashes from the range of the data into
+        the scan state."""
+        data, start, end = self.stripped_range(data, start, end)
+        recording = stage_stats is not None
+        if recording:
+            started = time.perf_counter()
+            known_hashes = state.hash_count()
+        long_hashes = state.long_hashes
+        short_hashes = state.short_hashes
+        colliding_hashes = state.colliding_hashes
+        guarded_lines = [[] for _ in self.guards]
+        last_line_starts = {}
+        # Hashes already seen in the range, which need no decoding
+        seen_hashes = set()
+
+        for match in self.scan_pattern.finditer(data, start, end):
+            text = match.group()
+            if text in seen_hashes:
+                continue
+            if text.startswith(b'0x'):
+                seen_hashes.add(text)
+                if len(text) == 66:
+                    short_hash = generate_short_hash(text.decode())
+                    full_hash = binascii.unhexlify(text[2:])
+                    if long_hashes.setdefault(short_hash, full_hash) != full_hash:
+                        colliding_hashes.setdefault(full_hash, short_hash)
+                else:
+                    short_hashes.setdefault(text.decode())
+            else:
+                guard_index = self.guard_index(text.decode())
+                line_start = data.rfind(b'\n', start, match.start()) + 1 or start
+                if last_line_starts.get(guard_index) != line_start:
+                    last_line_starts[guard_index] = line_start
+                    guarded_lines[guard_index].append(line_start)
+
+        if recording:
+            add_stats('scan', started, end - start, state.hash_count() - known_hashes)
+
+        for guard_index, guard_regex in self.line_guards:
+            line_start = start
+            while line_start < end:
+                line_end = data.find(b'\n', line_start, end)
+                if line_end == -1:
+                    line_end = end
+                if guard_regex.search(data[line_start:line_end]):
+                    guarded_lines[guard_index].append(line_start)
+                line_start = line_end + 1
+
+        for guard_index, line_starts in enumerate(guarded_lines):
+            lines = []
+            for line_start in line_starts:
+                line_end = data.find(b'\n', line_start, end)
+                lines.append(data[line_start:end if line_end == -1 else line_end].decode())
+            if not lines:
+                continue
+            if recording:
+                started = time.perf_counter()
+            found_matches = self.rule_matchers[guard_index].find(lines, state.rule_matches)
+            if recording:
+                self.rule_matchers[guard_index].add_find_stats(started, lines, found_matches)
+
+    def rewrite(self, data, hash_to_word, start=0, end=None):
+        """Replace all known hashes in the range of the data with their
+        words. Returns the new content as bytes and the (number, parent,
+        child) edges of its Imported lines."""
+        data, start, end = self.stripped_range(data, start, end)
+        if stage_stats is not None:
+            started = time.perf_counter()
+        collisions = getattr(hash_to_word, 'collisions', None)
+        words = {}
+
+        def word(h):
+            encoded_word = words.get(h)
+            if encoded_word is None:
+                text = h.decode()
+                found_word = collisions.get(binascii.unhexlify(h[2:])) if collisions and len(h) == 66 else None
+                if found_word is None:
+                    found_word = hash_to_word[generate_short_hash(text) if len(h) == 66 else text]
+                encoded_word = words[h] = found_word.encode()
+            return encoded_word
+
+        def replace_token(match):
+            return word(match.group())
+
+        parts = []
+        edges = []
+        last_end = start
+        last_edge_line_start = -1
+
+        for match in self.rewrite_pattern.finditer(data, start, end):
+            text = match.group()
+            match_start, match_end = match.span()
+            parts.append(data[last_end:match_start])
+            last_end = match_end
+            if match.lastindex:
+                parent = self.hash_pattern.sub(replace_token, match.group(2))
+                child = self.hash_pattern.sub(replace_token, match.group(3))
+                parts.append(b"Imported #%s (%s \xe2\x86\x92 %s)" % (match.group(1), parent, child))
+                line_start = data.rfind(b'\n', start, match_start) + 1 or start
+                if line_start != last_edge_line_start:
+                    last_edge_line_start = line_start
+                    edges.append((int(match.group(1)), parent.decode(), child.decode()))
+            else:
+                parts.append(word(text))
+
+        parts.append(data[last_end:end])
+        if stage_stats is not None:
+            add_stats('rewrite', started, end - start, len(parts) // 2)
+        return b''.join(parts), edges
+
+# Scanners compiled for the current set of rules
+scanners = {}
+
+def get_scanner(strip_control_chars=False, binary=False):
+    """Get the scanner (a BytesScanner if binary is set) for the current set
+    of replacement rules."""
+    key = (tuple(specific_replacements), strip_control_chars, binary)
+    if key not in scanners:
+        scanners[key] = (BytesScanner if binary else Scanner)(specific_replacements, strip_control_chars)
+    return scanners[key]
+
+def scan_content(content, state):
+    """Collect rule matches and hashes from the content into the scan state."""
+    get_scanner().scan(content, state)
+
+def build_dictionary(state, initial_hash_to_word, rules=None, pool=None):
+    """Build the hash-to-word dictionary from the scan state. The initial
+    dictionary is extended in place if it is a HashToWord. The rules the state
+    was scanned with and the pool the words are drawn from default to the
+    predefined rules and word_pool."""
+    rules = specific_replacements if rules is None else rules
+    generate = (word_pool if pool is None else pool).generate
+    hash_to_word = initial_hash_to_word
+    if not isinstance(hash_to_word, HashToWord):
+        hash_to_word = HashToWord(initial_hash_to_word)
+
+    if stage_stats is not None:
+        started = time.perf_counter()
+        known_hashes = len(hash_to_word)
+    for rule_matches, (pattern, replacement_prefix, guard) in zip(state.rule_matches, rules):
+        for h, number in rule_matches.items():
+            if h not in hash_to_word:
+                hash_to_word[h] = hash_to_word.fork_word(f"{replacement_prefix}{number}")
+    if stage_stats is not None:
+        add_stats('rule words', started, matches=len(hash_to_word) - known_hashes)
+        started = time.perf_counter()
+        known_hashes = len(hash_to_word) + len(hash_to_word.collisions)
+
+    colliding_hashes = dict(state.colliding_hashes)
+    for short_hash, full_hash in state.long_hashes.items():
         if short_hash not in hash_to_word:
-            hash_to_word[short_hash] = generate_word()
-    # print(f"3 Execution time: {time.time() - start_time}")
+            hash_to_word[short_hash] = generate(short_hash, hash_to_word.word_to_hash)
+            hash_to_word.full_hashes[short_hash] = full_hash
+        elif hash_to_word.full_hash(short_hash) is None:
+            hash_to_word.full_hashes[short_hash] = full_hash
+        else:
+            colliding_hashes.setdefault(full_hash, short_hash)
 
-    start_time = time.time()
-    for short_hash in short_hashes:
+    for short_hash in state.short_hashes:
         if short_hash not in hash_to_word:
-            hash_to_word[short_hash] = generate_word()
-    # print(f"4 Execution time: {time.time() - start_time}")
+            hash_to_word[short_hash] = generate(short_hash, hash_to_word.word_to_hash)
 
-    # print(f"long_hashes count: {len(long_hashes)}")
-    # print(f"short_hashes count: {len(short_hashes)}")
-    print(f"hash_to_word count: {len(hash_to_word)}")
+    # Sorted, so the words do not depend on where the content was split
+    for full_hash, short_hash in sorted(colliding_hashes.items()):
+        if hash_to_word.full_hash(short_hash) != full_hash and full_hash not in hash_to_word.collisions:
+            long_hash = '0x' + full_hash.hex()
+            hash_to_word.add_collision(full_hash, generate(long_hash, hash_to_word.word_to_hash))
+    if stage_stats is not None:
+        add_stats('words', started, matches=len(hash_to_word) + len(hash_to_word.collisions) - known_hashes)
 
-    start_time = time.time()
-    content = replace_matches_in_place(content, r'0x[0-9a-f]{4}…[0-9a-f]{4}', lambda h: hash_to_word[h])
-    content = replace_matches_in_place(content, r'0x[0-9a-f]{64}', lambda h: hash_to_word[generate_short_hash(h)])
-    # print(f"5 Execution time: {time.time() - start_time}")
+    return hash_to_word
 
-    return content, hash_to_word
+def rewrite_content(content, hash_to_word):
+    """Replace all known hashes in the content with their words."""
+    return get_scanner().rewrite(content, hash_to_word)[0]
 
-def write_dictionary_to_file(file_path, hash_to_word):
-    """Write the hash-to-word dictionary to a file."""
-    dict_file_path = file_path + ".dict"
-    with open(dict_file_path, 'w') as dict_file:
-        for short_hash, word in hash_to_word.items():
-            dict_file.write(f"{short_hash}: {word}\n")
+def replace_hashes(content, initial_hash_to_word):
+    """Build dictionary and replace hashes in the content."""
+    state = ScanState()
+    scan_content(content, state)
+    hash_to_word = build_dictionary(state, initial_hash_to_word)
+    report_dictionary(hash_to_word, sys.stdout)
 
-def read_dictionary_from_file(dict_file_path):
-    """Read the hash-to-word dictionary from a file."""
-    hash_to_word = {}
-    with open(dict_file_path, 'r') as dict_file:
+    return rewrite_content(content, hash_to_word), hash_to_word
+
+def write_dictionary_to_file(file_path, hash_to_word, binary=False, compression=None):
+    """Write the hash-to-word dictionary to a file, in the binary format if
+    asked to, or compressed with the given compression."""
+    if stage_stats is not None:
+        started = time.perf_counter()
+    dict_file_path = sidecar_file_path(file_path, ".dict", compression)
+    if binary:
+        write_binary_dictionary(dict_file_path, hash_to_word)
+    else:
+        if not isinstance(hash_to_word, HashToWord):
+            hash_to_word = HashToWord(hash_to_word)
+        write_text_dictionary(dict_file_path, hash_to_word.entries())
+    if stage_stats is not None:
+        add_stats('dictionary file', started, matches=len(hash_to_word))
+
+def dictionary_line(h, word):
+    """The line of a text dictionary file of the entry: the short hash and
+    the word, then the full hash if known, so the file can still be searched
+    for the short hashes of the log."""
+    if len(h) == 66:
+        return f"{generate_short_hash(h)}: {word}: {h}\n"
+    return f"{h}: {word}\n"
+
+def write_text_dictionary(dict_file_path, entries, mode='w'):
+    """Write the (hash, word) entries to a text dictionary file, one per line,
+    or append them with mode 'a'. A written file is replaced rather than
+    rewritten, as the entries may come from a dictionary mapping it."""
+    if mode == 'a':
+        with open_log(dict_file_path, mode) as dict_file:
+            for h, word in entries:
+                dict_file.write(dictionary_line(h, word))
+        return
+    dict_file, temporary_path = open_temporary_log(dict_file_path)
+    try:
+        with dict_file:
+            for h, word in entries:
+                dict_file.write(dictionary_line(h, word))
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    os.replace(temporary_path, dict_file_path)
+
+def read_text_dictionary(dict_file_path):
+    """Read the hash-to-word dictionary from a text dictionary file, see
+    dictionary_line. The first field may also be a full hash."""
+    hash_to_word = HashToWord()
+    with open_log(dict_file_path, 'r') as dict_file:
         for line in dict_file:
-            short_hash, word = line.strip().split(": ")
-            hash_to_word[short_hash] = word
+            fields = line.strip().split(": ")
+            hash_to_word.add_entry(fields[2] if len(fields) == 3 else fields[0], fields[1])
     return hash_to_word
 
+def read_dictionary_from_file(dict_file_path):
+    """Read the hash-to-word dictionary from a file. A binary dictionary is
+    memory-mapped rather than read."""
+    if is_binary_dictionary(dict_file_path):
+        return HashToWord(base=MappedDictionary(dict_file_path))
+    return read_text_dictionary(dict_file_path)
+
+# Binary dictionary layout, all integers are little-endian uint32:
+#   header: magic, number of entries N, number of colliding long hashes M,
+#           size of the word blob
+#   keys: N short hashes as integers (their 8 nibbles), sorted
+#   full hashes: N full hashes of the keys, 32 bytes each, zeros if unknown
+#   colliding hashes: M full hashes of colliding long hashes, sorted
+#   word offsets: N + M + 1 offsets of the words of the keys, then of the
+#                 colliding hashes, in the word blob
+#   word order: N + M word indexes, sorted by their words
+#   word blob: the UTF-8 encoded words
+BINARY_DICT_MAGIC = b"DEHASHD1"
+BINARY_DICT_HEADER = struct.Struct('<8sIII')
+BINARY_DICT_INTEGER = struct.Struct('<I')
+FULL_HASH_SIZE = 32
+UNKNOWN_FULL_HASH = bytes(FULL_HASH_SIZE)
+
+def short_hash_key(short_hash):
+    """Get the integer key of the short hash in a binary dictionary."""
+    if not re.fullmatch(SHORT_HASH_PATTERN, short_hash):
+        raise ValueError(f"only short hashes can be stored in a binary dictionary: {short_hash}")
+    return int(short_hash[2:6] + short_hash[-4:], 16)
+
+def key_short_hash(key):
+    nibbles = f"{key:08x}"
+    return f"0x{nibbles[:4]}…{nibbles[4:]}"
+
+def is_binary_dictionary(dict_file_path):
+    with open(dict_file_path, 'rb') as dict_file:
+        return dict_file.read(len(BINARY_DICT_MAGIC)) == BINARY_DICT_MAGIC
+
+def write_binary_dictionary(dict_file_path, hash_to_word):
+    """Write the hash-to-word dictionary to a binary dictionary file. The file
+    is replaced rather than rewritten, as it may be mapped by the dictionary."""
+    if not isinstance(hash_to_word, HashToWord):
+        hash_to_word = HashToWord(hash_to_word)
+    entries = sorted((short_hash_key(short_hash), hash_to_word.full_hash(short_hash) or UNKNOWN_FULL_HASH, word.encode())
+                     for short_hash, word in hash_to_word.items())
+    collisions = sorted((full_hash, word.encode()) for full_hash, word in hash_to_word.collisions.items())
+    words = [word for key, full_hash, word in entries] + [word for full_hash, word in collisions]
+    offsets = [0]
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    word_order = sorted(range(len(words)), key=lambda index: words[index])
+
+    with open(dict_file_path + ".tmp", 'wb') as dict_file:
+        dict_file.write(BINARY_DICT_HEADER.pack(BINARY_DICT_MAGIC, len(entries), len(collisions), offsets[-1]))
+        dict_file.write(struct.pack(f'<{len(entries)}I', *(key for key, full_hash, word in entries)))
+        dict_file.write(b''.join(full_hash for key, full_hash, word in entries))
+        dict_file.write(b''.join(full_hash for full_hash, word in collisions))
+        dict_file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        dict_file.write(struct.pack(f'<{len(word_order)}I', *word_order))
+        dict_file.write(b''.join(words))
+    os.replace(dict_file_path + ".tmp", dict_file_path)
+
+class MappedDictionary(collections.abc.Mapping):
+    """Read-only hash-to-word dictionary backed by a memory-mapped binary
+    dictionary file. Opening it costs the same for any number of entries;
+    hashes and words are looked up with a binary search."""
+    def __init__(self, dict_file_path):
+        self.path = dict_file_path
+        with open(dict_file_path, 'rb') as dict_file:
+            self.map = mmap.mmap(dict_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.collision_count, blob_size = BINARY_DICT_HEADER.unpack_from(self.map, 0)
+        if magic != BINARY_DICT_MAGIC:
+            raise ValueError(f"{dict_file_path} is not a binary dictionary")
+        self.keys_start = BINARY_DICT_HEADER.size
+        self.full_hashes_start = self.keys_start + 4 * self.count
+        self.collisions_start = self.full_hashes_start + FULL_HASH_SIZE * self.count
+        self.offsets_start = self.collisions_start + FULL_HASH_SIZE * self.collision_count
+        self.order_start = self.offsets_start + 4 * (self.count + self.collision_count + 1)
+        self.blob_start = self.order_start + 4 * (self.count + self.collision_count)
+
+    def __reduce__(self):
+        return (MappedDictionary, (self.path,))
+
+    def integer(self, start, index):
+        return BINARY_DICT_INTEGER.unpack_from(self.map, start + 4 * index)[0]
+
+    def full_hash_at(self, start, index):
+        return self.map[start + FULL_HASH_SIZE * index:start + FULL_HASH_SIZE * (index + 1)]
+
+    def word_at(self, index):
+        start = self.blob_start + self.integer(self.offsets_start, index)
+        end = self.blob_start + self.integer(self.offsets_start, index + 1)
+        return self.map[start:end].decode()
+
+    def hash_at(self, index):
+        """The short hash of the word at the index, or the full hash of a
+        colliding long hash."""
+        if index >= self.count:
+            return '0x' + self.full_hash_at(self.collisions_start, index - self.count).hex()
+        return key_short_hash(self.integer(self.keys_start, index))
+
+    def find(self, short_hash):
+        """Find the index of the short hash, or -1 if it is not there."""
+        try:
+            key = short_hash_key(short_hash)
+        except (ValueError, TypeError):
+            return -1
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.integer(self.keys_start, middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.integer(self.keys_start, low) == key:
+            return low
+        return -1
+
+    def full_hash(self, short_hash):
+        """Get the full hash (32 bytes) behind the short hash, if known."""
+        index = self.find(short_hash)
+        if index == -1:
+            return None
+        full_hash = self.full_hash_at(self.full_hashes_start, index)
+        return full_hash if full_hash != UNKNOWN_FULL_HASH else None
+
+    def collisions(self):
+        """The words of the colliding long hashes, by their full hash."""
+        return {self.full_hash_at(self.collisions_start, index): self.word_at(self.count + index)
+                for index in range(self.collision_count)}
+
+    def hash_of_word(self, word):
+        """Find the hash of the word, or None if it is not there."""
+        encoded = word.encode()
+        total = self.count + self.collision_count
+        low, high = 0, total
+        while low < high:
+            middle = (low + high) // 2
+            if self.word_at(self.integer(self.order_start, middle)).encode() < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < total:
+            index = self.integer(self.order_start, low)
+            if self.word_at(index) == word:
+                return self.hash_at(index)
+        return None
+
+    def has_word(self, word):
+        return self.hash_of_word(word) is not None
+
+    def __getitem__(self, short_hash):
+        index = self.find(short_hash)
+        if index == -1:
+            raise KeyError(short_hash)
+        return self.word_at(index)
+
+    def __contains__(self, short_hash):
+        return self.find(short_hash) != -1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (self.hash_at(index) for index in range(self.count))
+
+    def items(self):
+        return ((self.hash_at(index), self.word_at(index)) for index in range(self.count))
+
+def convert_dictionary(source_path, target_path):
+    """Convert a text dictionary file to the binary format, or a binary one
+    to the text format."""
+    hash_to_word = read_dictionary_from_file(source_path)
+    if is_binary_dictionary(source_path):
+        write_text_dictionary(target_path, hash_to_word.entries())
+    else:
+        write_binary_dictionary(target_path, hash_to_word)
+
+def word_token_pattern(words):
+    """Regex of the whole-word tokens that can be one of the words: made of
+    the characters the words start with and contain. Tokens are then looked
+    up in a set of the words, which takes the same time for any number of
+    words. None if there are no words."""
+    first_chars = ''.join(sorted({word[0] for word in words if word}))
+    chars = ''.join(sorted({char for word in words for char in word[1:]}))
+    if not first_chars:
+        return None
+    if chars:
+        return rf'\b[{re.escape(first_chars)}][{re.escape(chars)}]*\b'
+    return rf'\b[{re.escape(first_chars)}]\b'
+
+def append_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def read_varints(data):
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield value
+            value = 0
+            shift = 0
+
+class WordIndexBuilder:
+    """Builds the index of the lines where the words of a dictionary appear
+    in a dehashed log, fed with the chunks (of whole lines) of the log in
+    order. The postings of a word are the (line number, byte offset) of its
+    lines, kept as varint encoded deltas from the previous line. The tokens
+    of the log are matched as bytes, see word_token_pattern, so a word of
+    the log that is also a dictionary word is indexed too."""
+    def __init__(self, words):
+        self.words = {word.encode() for word in words}
+        token_pattern = word_token_pattern(words)
+        self.token_pattern = re.compile(token_pattern.encode()) if token_pattern else None
+        # word: [encoded deltas, last line, last offset]
+        self.postings = {}
+        self.line = 0
+        self.line_start = 0
+        self.offset = 0
+
+    def add(self, chunk):
+        """Index the next chunk of the log, as text or bytes."""
+        if stage_stats is not None:
+            started = time.perf_counter()
+        data = chunk.encode() if isinstance(chunk, str) else chunk
+        line = self.line
+        line_start = self.line_start
+        counted = 0
+        found = 0
+        if self.token_pattern is not None:
+            for match in self.token_pattern.finditer(data):
+                token = match.group()
+                if token not in self.words:
+                    continue
+                start = match.start()
+                newlines = data.count(b'\n', counted, start)
+                if newlines:
+                    line += newlines
+                    line_start = self.offset + data.rfind(b'\n', counted, start) + 1
+                counted = start
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = [bytearray(), -1, 0]
+                elif posting[1] == line:
+                    continue
+                found += 1
+                append_varint(posting[0], line - max(posting[1], 0))
+                append_varint(posting[0], line_start - posting[2])
+                posting[1] = line
+                posting[2] = line_start
+        newlines = data.count(b'\n', counted)
+        if newlines:
+            self.line = line + newlines
+            self.line_start = self.offset + data.rfind(b'\n', counted) + 1
+        else:
+            self.line = line
+            self.line_start = line_start
+        self.offset += len(data)
+        if stage_stats is not None:
+            add_stats('index', started, len(data), found)
+
+    def write(self, index_path):
+        write_word_index(index_path, {word: posting[0] for word, posting in self.postings.items()})
+
+# Word index layout, integers are little-endian:
+#   header: magic, number of words N (uint32), size of the word blob (uint32)
+#   word offsets: N + 1 uint32 offsets of the words, sorted, in the word blob
+#   postings offsets: N + 1 uint64 offsets of their postings in the postings
+#                     blob
+#   word blob: the UTF-8 encoded words
+#   postings blob: for every word, varint pairs of the deltas of the line
+#                  number and of the byte offset of the lines it appears on
+WORD_INDEX_MAGIC = b"DEHASHX1"
+WORD_INDEX_HEADER = struct.Struct('<8sII')
+
+def write_word_index(index_path, postings):
+    """Write the word index of the (encoded word: encoded postings) to a
+    file, see WORD_INDEX_MAGIC."""
+    words = sorted(postings)
+    word_offsets = [0]
+    postings_offsets = [0]
+    for word in words:
+        word_offsets.append(word_offsets[-1] + len(word))
+        postings_offsets.append(postings_offsets[-1] + len(postings[word]))
+    with open(index_path + ".tmp", 'wb') as index_file:
+        index_file.write(WORD_INDEX_HEADER.pack(WORD_INDEX_MAGIC, len(words), word_offsets[-1]))
+        index_file.write(struct.pack(f'<{len(word_offsets)}I', *word_offsets))
+        index_file.write(struct.pack(f'<{len(postings_offsets)}Q', *postings_offsets))
+        index_file.write(b''.join(words))
+        for word in words:
+            index_file.write(postings[word])
+    os.replace(index_path + ".tmp", index_path)
+
+def lookup_word(index_path, word):
+    """Find the (line number, byte offset) of the lines of the indexed log
+    where the word appears, with a binary search in the memory-mapped index.
+    Line numbers start at 0."""
+    with open(index_path, 'rb') as index_file:
+        data = map_file(index_file)
+    try:
+        magic, count, blob_size = WORD_INDEX_HEADER.unpack_from(data, 0)
+        if magic != WORD_INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a word index")
+        word_offsets_start = WORD_INDEX_HEADER.size
+        postings_offsets_start = word_offsets_start + 4 * (count + 1)
+        blob_start = postings_offsets_start + 8 * (count + 1)
+        postings_start = blob_start + blob_size
+
+        def word_at(index):
+            start, end = struct.unpack_from('<II', data, word_offsets_start + 4 * index)
+            return data[blob_start + start:blob_start + end]
+
+        target = word.encode()
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if word_at(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low == count or word_at(low) != target:
+            return []
+        start, end = struct.unpack_from('<QQ', data, postings_offsets_start + 8 * low)
+        deltas = read_varints(data[postings_start + start:postings_start + end])
+        lines = []
+        line = offset = 0
+        for line_delta, offset_delta in zip(deltas, deltas):
+            line += line_delta
+            offset += offset_delta
+            lines.append((line, offset))
+        return lines
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+def print_lookup(log_path, index_path, word, file=None):
+    """Print the lines of the dehashed log where the word appears, numbered
+    like grep -n, reading only those lines. The log must not be compressed, as
+    seeking in it would decompress it from the start."""
+    if compression_of(log_path):
+        raise ValueError(f"{log_path}: lines of a compressed log cannot be looked up")
+    file = file or sys.stdout
+    with open(log_path, 'rb') as log_file:
+        for line, offset in lookup_word(index_path, word):
+            log_file.seek(offset)
+            print(f"{line + 1}:{log_file.readline().decode().rstrip(chr(10))}", file=file)
+
+def find_dot_edges(content):
+    """Find parent-child relationships in the dehashed content."""
+    edges = []
+    for line in content.split('\n'):
+        match = re.search(DOT_EDGE_PATTERN, line)
+        if match:
+            edges.append((int(match.group(1)), match.group(2), match.group(3)))
+    return edges
+
+def write_dot_header(dot_file):
+    dot_file.write("digraph G {\n")
+    dot_file.write("    rankdir=BT;\n")
+
+def write_dot_edges(dot_file, edges):
+    for number, parent, child in edges:
+        dot_file.write(f'    "{child}" -> "{parent}";\n')
+
+def write_dot_footer(dot_file):
+    dot_file.write("}\n")
+
 def write_dot_file(content, file_path):
     """Write a DOT file representing parent-child relationships."""
     dot_file_path = file_path + ".dot"
-    lines = content.split('\n')
-    edges = []
+    with open(dot_file_path, 'w') as dot_file:
+        write_dot_header(dot_file)
+        write_dot_edges(dot_file, find_dot_edges(content))
+        write_dot_footer(dot_file)
 
-    # Extract parent-child relationships
-    for line in lines:
-        match = re.search(r'Imported #(\d+) \((\w+) → (\w+)\)', line)
-        if match:
-            parent = match.group(2)
-            child = match.group(3)
-            edges.append((parent, child))
 
-    # Write to dot file
-    with open(dot_file_path, 'w') as dot_file:
-        dot_file.write("digraph G {\n")
-        dot_file.write("    rankdir=BT;\n")
-        for parent, child in edges:
-            dot_file.write(f'    "{child}" -> "{parent}";\n')
-        dot_file.write("}\n")
+# Number of blocks kept around every fork in a collapsed DOT file
+FORK_CONTEXT = 2
+
+class BlockTree:
+    """The tree (or forest, e.g. of a relay chain and a parachain) of the
+    imported blocks, built from the edges found by the rewrite pass. Every
+    block keeps its number, its parent and its children. The tip of every
+    tree is its first block of the highest number; an import above the tip
+    that does not extend it is a reorg."""
+    def __init__(self):
+        self.numbers = {}
+        self.parents = {}
+        self.children = collections.defaultdict(list)
+        self.roots = {}
+        self.tips = {}
+        self.reorgs = []
+
+    def add_edges(self, edges):
+        for number, parent, child in edges:
+            self.add(number, parent, child)
+
+    def add(self, number, parent, child):
+        if child in self.parents or child == parent:
+            return
+        if parent not in self.numbers:
+            self.numbers[parent] = number - 1
+            self.roots[parent] = parent
+        self.numbers.setdefault(child, number)
+        self.parents[child] = parent
+        self.children[parent].append(child)
+        root = self.roots[child] = self.roots[parent]
 
-    # print(f"DOT file created at {dot_file_path}")
+        tip = self.tips.get(root, parent)
+        if number > self.numbers[tip]:
+            if parent != tip:
+                ancestor = self.common_ancestor(parent, tip)
+                self.reorgs.append({
+                    'number': number,
+                    'block': child,
+                    'previous_tip': tip,
+                    'ancestor': ancestor,
+                    'depth': self.numbers[tip] - self.numbers[ancestor] if ancestor is not None else None,
+                })
+            self.tips[root] = child
 
+    def common_ancestor(self, first, second):
+        while first != second:
+            if first is None or second is None:
+                return None
+            if self.numbers.get(first, -1) >= self.numbers.get(second, -1):
+                first = self.parents.get(first)
+            else:
+                second = self.parents.get(second)
+        return first
+
+    def heights(self):
+        """Height of the subtree of every block (0 for leaves)."""
+        heights = {}
+        for root in self.roots.values():
+            if root in heights:
+                continue
+            stack = [root]
+            while stack:
+                block = stack[-1]
+                pending = [child for child in self.children.get(block, ()) if child not in heights]
+                if pending:
+                    stack.extend(pending)
+                else:
+                    stack.pop()
+                    heights[block] = 1 + max((heights[child] for child in self.children.get(block, ())), default=-1)
+        return heights
+
+    def fork_points(self):
+        return [block for block, children in self.children.items() if len(children) > 1]
+
+    def fork_stats(self):
+        """Statistics of the forks: every fork point with the depth of its
+        shorter branches, and the reorgs."""
+        heights = self.heights()
+        fork_points = []
+        for block in self.fork_points():
+            branch_heights = sorted((1 + heights[child] for child in self.children[block]), reverse=True)
+            fork_points.append({
+                'number': self.numbers[block],
+                'block': block,
+                'children': self.children[block],
+                'depth': branch_heights[1],
+            })
+        main_chains = set()
+        for tip in self.tips.values():
+            block = tip
+            while block is not None:
+                main_chains.add(block)
+                block = self.parents.get(block)
+        return {
+            'blocks': len(self.numbers),
+            'roots': len(set(self.roots.values())),
+            'tips': sorted(self.tips.values(), key=lambda tip: self.numbers[tip]),
+            'forks': len(fork_points),
+            'fork_blocks': len(self.numbers) - len(main_chains),
+            'max_fork_depth': max((fork['depth'] for fork in fork_points), default=0),
+            'reorg_count': len(self.reorgs),
+            'fork_points': sorted(fork_points, key=lambda fork: fork['number']),
+            'reorgs': self.reorgs,
+        }
+
+    def collapsed_edges(self, context=FORK_CONTEXT, keep=()):
+        """The edges of the tree with the linear runs of blocks folded. Kept
+        are the roots, the tips, the leaves, the blocks up to context blocks
+        away from a fork and the blocks to keep. Yields (child, parent,
+        folded) edges, folded being the number of blocks left out between
+        them."""
+        kept = set(self.roots.values()) | set(self.tips.values()) | set(keep)
+        kept.update(block for block in self.numbers if block not in self.children)
+        for fork in self.fork_points():
+            block = fork
+            for _ in range(context + 1):
+                if block is None:
+                    break
+                kept.add(block)
+                block = self.parents.get(block)
+            level = [fork]
+            for _ in range(context):
+                level = [child for block in level for child in self.children.get(block, ())]
+                kept.update(level)
+
+        for block in self.numbers:
+            if block not in kept or block not in self.parents:
+                continue
+            parent = self.parents[block]
+            folded = 0
+            while parent not in kept:
+                parent = self.parents[parent]
+                folded += 1
+            yield block, parent, folded
+
+def write_collapsed_dot_file(dot_file_path, block_tree, context=FORK_CONTEXT):
+    """Write the block tree as a DOT file with the linear runs of blocks
+    folded into dashed edges, so long chains stay viewable."""
+    with open_log(dot_file_path, 'w') as dot_file:
+        write_dot_header(dot_file)
+        for child, parent, folded in block_tree.collapsed_edges(context):
+            if folded:
+                dot_file.write(f'    "{child}" -> "{parent}" [style=dashed, label="{folded} blocks"];\n')
+            else:
+                dot_file.write(f'    "{child}" -> "{parent}";\n')
+        write_dot_footer(dot_file)
+
+def write_batch_dot_file(dot_file_path, node_names, block_trees, collapse_dot=False, context=FORK_CONTEXT):
+    """Write the block trees of several nodes as one DOT file. An edge not
+    seen by all the nodes is labelled with the names of the nodes that saw
+    it, and every node is a box pointing at the tips of its view of the
+    chains. If collapse_dot is set, the linear runs of blocks of the combined
+    tree are folded, see BlockTree.collapsed_edges."""
+    block_tree = BlockTree()
+    seen_by = {}
+    for name, node_tree in zip(node_names, block_trees):
+        for child, parent in node_tree.parents.items():
+            block_tree.add(node_tree.numbers[child], parent, child)
+            seen_by.setdefault((child, parent), []).append(name)
+    node_tips = [set(node_tree.tips.values()) for node_tree in block_trees]
+
+    if collapse_dot:
+        edges = block_tree.collapsed_edges(context, keep=set().union(*node_tips))
+    else:
+        edges = ((child, parent, 0) for child, parent in seen_by)
+    with open_log(dot_file_path, 'w') as dot_file:
+        write_dot_header(dot_file)
+        for child, parent, folded in edges:
+            names = seen_by.get((child, parent), ())
+            if folded:
+                dot_file.write(f'    "{child}" -> "{parent}" [style=dashed, label="{folded} blocks"];\n')
+            elif len(names) < len(node_names):
+                dot_file.write(f'    "{child}" -> "{parent}" [label="{", ".join(names)}"];\n')
+            else:
+                dot_file.write(f'    "{child}" -> "{parent}";\n')
+        for name, tips in zip(node_names, node_tips):
+            dot_file.write(f'    "{name}" [shape=box];\n')
+            for tip in sorted(tips, key=block_tree.numbers.get):
+                dot_file.write(f'    "{name}" -> "{tip}" [style=dotted];\n')
+        write_dot_footer(dot_file)
+    return block_tree
+
+def write_fork_stats(fork_stats_path, block_tree):
+    with open_log(fork_stats_path, 'w') as fork_stats_file:
+        json.dump(block_tree.fork_stats(), fork_stats_file, indent=2)
+
+# ANSI escapes are tried first, so a single pass strips both
+control_chars_regex = re.compile(f'{ANSI_ESCAPE_PATTERN}|{CONTROL_CHAR_PATTERN}')
 
 def remove_control_chars(text):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    control_chars = re.compile(r'[\x00-\x08\x0B-\x1F\x7F-\x9F]')
-    text = ansi_escape.sub('', text)
-    text = control_chars.sub('', text)
-    return text
+    return control_chars_regex.sub('', text)
+
+
+def read_chunks(file, chunk_size=STREAM_CHUNK_SIZE):
+    """Read the file in chunks of whole lines of roughly chunk_size characters."""
+    while True:
+        lines = file.readlines(chunk_size)
+        if not lines:
+            break
+        yield ''.join(lines)
+
+# Suffixes of the compressed logs and sidecar files, which are (de)compressed
+# on the fly when read or written
+COMPRESSIONS = ('gz', 'xz', 'zst')
+
+def compression_of(path):
+    """The compression of the file from its suffix: 'gz', 'xz', 'zst' or None."""
+    suffix = os.path.splitext(path)[1][1:]
+    return suffix if suffix in COMPRESSIONS else None
+
+def log_base_path(path):
+    """The path without its compression suffix, e.g. node.log for node.log.gz."""
+    return os.path.splitext(path)[0] if compression_of(path) else path
+
+def sidecar_file_path(sidecar_path, extension, compression=None):
+    """Path of a sidecar file, e.g. node.log.dot, or node.log.dot.gz if it
+    is compressed."""
+    return f"{sidecar_path}{extension}.{compression}" if compression else sidecar_path + extension
+
+class ZstdReader(io.RawIOBase):
+    """Raw stream of a zstd file decompressed with the zstandard package. It
+    can only seek back to the start, by decompressing again, which is enough
+    to read a log twice."""
+    def __init__(self, path, zstandard):
+        self.path = path
+        self.zstandard = zstandard
+        self.reader = None
+        self.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.reader.readinto(buffer)
+
+    def tell(self):
+        return self.reader.tell()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR and offset == 0:
+            return self.tell()
+        if whence != io.SEEK_SET or offset != 0:
+            raise io.UnsupportedOperation("zstd files can only be rewound")
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = self.zstandard.ZstdDecompressor().stream_reader(open(self.path, 'rb'), closefd=True)
+        return 0
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+        super().close()
+
+def open_zstd(path, mode):
+    try:
+        from compression import zstd
+        return zstd.open(path, mode)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"{path}: zstd files need Python 3.14 or the zstandard package") from None
+    if mode.startswith('r'):
+        reader = io.BufferedReader(ZstdReader(path, zstandard))
+        return reader if 'b' in mode else io.TextIOWrapper(reader)
+    return zstandard.open(path, mode)
+
+def open_log(path, mode='r'):
+    """Open a file (in text mode unless mode has 'b'), or if its name ends
+    with .gz, .xz or .zst, a stream (de)compressing it on the fly. A
+    compressed file opened for reading can be rewound with seek(0), which
+    decompresses it again."""
+    compression = compression_of(path)
+    if compression and 'b' not in mode:
+        mode += 't'
+    if compression == 'gz':
+        return gzip.open(path, mode, compresslevel=6)
+    if compression == 'xz':
+        return lzma.open(path, mode)
+    if compression == 'zst':
+        return open_zstd(path, mode)
+    return open(path, mode)
+
+def open_temporary_log(path, mode='w'):
+    """Create a temporary file in the directory of the path, compressed like
+    it, to be moved over it when complete. Returns the temporary file opened
+    for writing and its path. The file gets the mode a new file gets from
+    open (mkstemp making it private)."""
+    compression = compression_of(path)
+    fd, temporary_path = tempfile.mkstemp(suffix=f".{compression}" if compression else '', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temporary_path, 0o666 & ~umask)
+    return open_log(temporary_path, mode), temporary_path
+
+def spool_stream(stream):
+    """Copy a non-seekable stream (e.g. stdin) to a temporary file, so it can
+    be read twice."""
+    spool = tempfile.NamedTemporaryFile('w+')
+    shutil.copyfileobj(stream, spool)
+    spool.flush()
+    spool.seek(0)
+    return spool
+
+def write_output(output_file, rewritten_chunks, hash_to_word, sidecar_path=None, binary_dict=False, collapse_dot=False, sidecar_compression=None, index=False):
+    """Write the rewritten (content, edges) chunks to the output stream and
+    the .dict, .dot and .forks.json files next to sidecar_path, if given,
+    compressed with sidecar_compression, if given. The .dot file has an edge
+    for every Imported line, or if collapse_dot is set, only the forks and
+    the ends of the chains, see BlockTree.collapsed_edges. If index is set, a
+    .idx index of the lines of every word is written too (uncompressed, so
+    that it can be mapped), see WordIndexBuilder."""
+    block_tree = BlockTree()
+    index_builder = WordIndexBuilder(word_set(hash_to_word)) if sidecar_path and index else None
+    if sidecar_path:
+        dot_file_path = sidecar_file_path(sidecar_path, ".dot", sidecar_compression)
+    dot_file = open_log(dot_file_path, 'w') if sidecar_path and not collapse_dot else None
+    try:
+        if dot_file:
+            write_dot_header(dot_file)
+        for modified_chunk, edges in rewritten_chunks:
+            output_file.write(modified_chunk)
+            if sidecar_path:
+                block_tree.add_edges(edges)
+            if index_builder:
+                index_builder.add(modified_chunk)
+            if dot_file:
+                write_dot_edges(dot_file, edges)
+        if dot_file:
+            write_dot_footer(dot_file)
+    finally:
+        if dot_file:
+            dot_file.close()
+
+    if sidecar_path:
+        if collapse_dot:
+            write_collapsed_dot_file(dot_file_path, block_tree)
+        write_fork_stats(sidecar_file_path(sidecar_path, ".forks.json", sidecar_compression), block_tree)
+        write_dictionary_to_file(sidecar_path, hash_to_word, binary=binary_dict, compression=sidecar_compression)
+    if index_builder:
+        index_builder.write(sidecar_path + ".idx")
+
+def word_set(hash_to_word):
+    """The words of the hash-to-word dictionary, including the words of
+    colliding long hashes."""
+    if not isinstance(hash_to_word, HashToWord):
+        return set(hash_to_word.values())
+    return {word for h, word in hash_to_word.entries()}
+
+def process_stream(input_file, output_file, initial_hash_to_word, sidecar_path=None, chunk_size=STREAM_CHUNK_SIZE, binary_dict=False, collapse_dot=False, sidecar_compression=None, index=False):
+    """Dehash the seekable input stream into the output stream. The input is
+    read twice in chunks of whole lines: first to build the dictionary, then to
+    rewrite it, so the memory used does not depend on the size of the input.
+    The .dict and .dot files are written next to sidecar_path, if given."""
+    scanner = get_scanner(strip_control_chars=True)
+    state = ScanState()
+    for chunk in read_chunks(input_file, chunk_size):
+        scanner.scan(chunk, state)
+
+    hash_to_word = build_dictionary(state, initial_hash_to_word)
+    report_dictionary(hash_to_word)
+
+    input_file.seek(0)
+    rewritten_chunks = (scanner.rewrite(chunk, hash_to_word) for chunk in read_chunks(input_file, chunk_size))
+    write_output(output_file, rewritten_chunks, hash_to_word, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot,
+                 sidecar_compression=sidecar_compression, index=index)
+    return hash_to_word
+
+def split_file(file_path, chunk_size=PARALLEL_CHUNK_SIZE, start=0, end=None):
+    """Split the file, or its part from the start to the end offset, into
+    (start, end) byte ranges of roughly chunk_size bytes, each ending at a
+    line boundary."""
+    ranges = []
+    if end is None:
+        end = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        while start < end:
+            file.seek(start + chunk_size)
+            file.readline()
+            range_end = min(file.tell(), end)
+            ranges.append((start, range_end))
+            start = range_end
+    return ranges
 
+def read_text_range(file_path, start, end):
+    """Read the byte range of the file as text, decoded the same way as when
+    the whole file is opened in text mode."""
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data)).read()
 
-def process_file(file_path, backup, initial_hash_to_word):
-    """Process the file by replacing hashes and creating backups if required."""
+# State of the worker processes used by process_parallel
+worker_file_path = None
+worker_scanner = None
+worker_hash_to_word = None
+worker_data = None
+
+def init_worker(file_path, rules, hash_to_word, recording_stats=False, mapped=False):
+    global worker_file_path, worker_scanner, worker_hash_to_word, worker_data, stage_stats
+    worker_file_path = file_path
+    worker_scanner = (BytesScanner if mapped else Scanner)(rules, strip_control_chars=True)
+    worker_hash_to_word = hash_to_word
+    if mapped:
+        with open(file_path, 'rb') as file:
+            worker_data = map_file(file)
+    stage_stats = Stats() if recording_stats else None
+
+def take_worker_stats():
+    """Take the stats recorded by the worker's task, if any."""
+    global stage_stats
+    if stage_stats is None:
+        return None
+    task_stats, stage_stats = stage_stats, Stats()
+    return task_stats
+
+def read_range(byte_range):
+    start, end = byte_range
+    return read_text_range(worker_file_path, start, end)
+
+def scan_range(byte_range):
+    state = ScanState()
+    if worker_data is not None:
+        worker_scanner.scan(worker_data, state, *byte_range)
+    else:
+        worker_scanner.scan(read_range(byte_range), state)
+    return state, take_worker_stats()
+
+def rewrite_range(byte_range):
+    if worker_data is not None:
+        return worker_scanner.rewrite(worker_data, worker_hash_to_word, *byte_range), take_worker_stats()
+    return worker_scanner.rewrite(read_range(byte_range), worker_hash_to_word), take_worker_stats()
+
+def read_batch_chunk(chunk):
+    """Text of a chunk of process_batch: a (path, start, end) byte range of a
+    log or, for a compressed log, the text itself."""
+    return chunk if isinstance(chunk, str) else read_text_range(*chunk)
+
+def scan_batch_chunk(batch_chunk):
+    index, chunk = batch_chunk
+    state = ScanState()
+    worker_scanner.scan(read_batch_chunk(chunk), state)
+    return state, take_worker_stats()
+
+def rewrite_batch_chunk(batch_chunk):
+    index, chunk = batch_chunk
+    return (index, worker_scanner.rewrite(read_batch_chunk(chunk), worker_hash_to_word)), take_worker_stats()
+
+def merge_worker_stats(results):
+    """Yield the results of worker tasks, adding the stats they recorded."""
+    for result, task_stats in results:
+        if task_stats is not None and stage_stats is not None:
+            stage_stats.merge(task_stats)
+        yield result
+
+def ordered_imap(pool, func, items, window):
+    """Like Pool.imap, but with at most window tasks in flight, so results
+    waiting for a slow consumer do not pile up in memory."""
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+def process_parallel(file_path, output_file, initial_hash_to_word, jobs, sidecar_path=None, chunk_size=PARALLEL_CHUNK_SIZE, binary_dict=False, collapse_dot=False, sidecar_compression=None, mapped=False, index=False):
+    """Dehash the file into the output stream using jobs worker processes.
+    The file is split at line boundaries, the chunks are scanned in parallel
+    and their states merged in order, so the dictionary is built exactly as
+    by process_stream. The chunks are then rewritten in parallel and written
+    out in order. If mapped is set, the workers memory-map the file and work
+    on bytes, see process_mapped, and the output stream must be binary."""
+    ranges = split_file(file_path, chunk_size)
+    rules = list(specific_replacements)
+
+    state = ScanState()
+    recording_stats = stage_stats is not None
+    with multiprocessing.Pool(jobs, init_worker, (file_path, rules, None, recording_stats, mapped)) as pool:
+        for range_state in merge_worker_stats(ordered_imap(pool, scan_range, ranges, 2 * jobs)):
+            state.merge(range_state)
+
+    hash_to_word = build_dictionary(state, initial_hash_to_word)
+    report_dictionary(hash_to_word)
+
+    with multiprocessing.Pool(jobs, init_worker, (file_path, rules, hash_to_word, recording_stats, mapped)) as pool:
+        rewritten_chunks = merge_worker_stats(ordered_imap(pool, rewrite_range, ranges, 2 * jobs))
+        write_output(output_file, rewritten_chunks, hash_to_word, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot,
+                     sidecar_compression=sidecar_compression, index=index)
+    return hash_to_word
+
+def dehash(input_file, output_file, initial_hash_to_word, sidecar_path=None, jobs=1, binary_dict=False, collapse_dot=False, sidecar_compression=None, index=False):
+    """Dehash the seekable input file object, in parallel if jobs > 1 (which
+    needs an uncompressed file)."""
+    if jobs > 1:
+        return process_parallel(input_file.name, output_file, initial_hash_to_word, jobs, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+    return process_stream(input_file, output_file, initial_hash_to_word, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+
+def map_file(file):
+    """Memory-map the file read-only (an empty file, which cannot be mapped,
+    gives empty bytes)."""
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        data.madvise(mmap.MADV_SEQUENTIAL)
+    return data
+
+def release_range(data, start, end):
+    """Drop the pages of a processed range of the mapped file from the
+    process, so its resident memory does not grow with the size of the file
+    (they stay in the page cache)."""
+    if isinstance(data, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED'):
+        page_start = start - start % mmap.PAGESIZE
+        data.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+
+def process_mapped(file_path, output_file, initial_hash_to_word, sidecar_path=None, jobs=1, chunk_size=STREAM_CHUNK_SIZE, binary_dict=False, collapse_dot=False, sidecar_compression=None, index=False):
+    """Dehash the UTF-8 file into the binary output stream without decoding
+    it: the file is memory-mapped and its chunks (of whole lines) are scanned
+    and rewritten as bytes, see BytesScanner, in parallel if jobs > 1. The
+    output is the same as from process_stream for UTF-8 logs with \n line
+    endings."""
+    if jobs > 1:
+        return process_parallel(file_path, output_file, initial_hash_to_word, jobs, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, mapped=True, index=index)
+    scanner = get_scanner(strip_control_chars=True, binary=True)
+    ranges = split_file(file_path, chunk_size)
+    with open(file_path, 'rb') as file:
+        data = map_file(file)
+        state = ScanState()
+        for start, end in ranges:
+            scanner.scan(data, state, start, end)
+            release_range(data, start, end)
+
+        hash_to_word = build_dictionary(state, initial_hash_to_word)
+        report_dictionary(hash_to_word)
+
+        def rewrite_range(start, end):
+            rewritten_chunk = scanner.rewrite(data, hash_to_word, start, end)
+            release_range(data, start, end)
+            return rewritten_chunk
+
+        rewritten_chunks = (rewrite_range(start, end) for start, end in ranges)
+        write_output(output_file, rewritten_chunks, hash_to_word, sidecar_path=sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot,
+                     sidecar_compression=sidecar_compression, index=index)
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return hash_to_word
+
+def find_last_line_end(file_path, start=0):
+    """Find the offset just past the last newline of the file, or the start
+    offset if there is no newline after it. Anything after that offset is a
+    line that is still being written."""
+    with open(file_path, 'rb') as file:
+        end = file.seek(0, os.SEEK_END)
+        while end > start:
+            block_start = max(start, end - 65536)
+            file.seek(block_start)
+            newline = file.read(end - block_start).rfind(b'\n')
+            if newline != -1:
+                return block_start + newline + 1
+            end = block_start
+    return start
+
+def file_fingerprint(file_path, size):
+    """Fingerprint of the first (at most 4kB) bytes of the file, used to tell
+    whether a checkpointed file was replaced, e.g. by log rotation."""
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read(min(size, 4096))).hexdigest()
+
+def read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r') as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def write_checkpoint(checkpoint_path, checkpoint):
+    with open(checkpoint_path + ".tmp", 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+def reopen_dot_file(dot_file_path):
+    """Open the DOT file to add more edges, dropping its footer."""
+    dot_file = open(dot_file_path, 'r+b')
+    footer = b"}\n"
+    dot_file.seek(-len(footer), os.SEEK_END)
+    if dot_file.read() == footer:
+        dot_file.seek(-len(footer), os.SEEK_END)
+        dot_file.truncate()
+    dot_file.close()
+    return open(dot_file_path, 'a')
+
+def process_incremental(input_path, output_path, initial_hash_to_word, sidecar_path=None, chunk_size=STREAM_CHUNK_SIZE, binary_dict=False):
+    """Dehash only the lines appended to the input since the previous run and
+    append them to the output ('-' for stdout). A checkpoint stored next to
+    the .dict file keeps the input offset reached, the state of the word pool
+    and the fork suffixes of BLOCK names, so every run continues where the
+    previous one stopped. Only the new lines are scanned and rewritten, but
+    the dictionary is not incremental: a text .dict file is read whole (and
+    only its new entries appended), a binary one is mapped but rewritten
+    whole. The .dot file is extended in place. No .forks.json file is
+    written, as the block tree of the previous runs is not kept.
+
+    A hash keeps the word it got when it was first seen, even if a later line
+    would have made it a BLOCK. The input is processed from the start again if
+    it got shorter or its beginning changed. A line still being written (with
+    no trailing newline yet) is left for the next run."""
+    if sidecar_path is None:
+        if output_path == '-':
+            raise ValueError("incremental processing needs a sidecar path to store the checkpoint")
+        sidecar_path = output_path
+
+    checkpoint_path = sidecar_path + ".ckpt"
+    dict_file_path = sidecar_path + ".dict"
+    dot_file_path = sidecar_path + ".dot"
+
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint is not None:
+        offset = checkpoint['offset']
+        if (os.path.getsize(input_path) < offset
+                or file_fingerprint(input_path, offset) != checkpoint['fingerprint']
+                or not os.path.exists(dict_file_path)
+                or not os.path.exists(dot_file_path)
+                or (output_path != '-' and not os.path.exists(output_path))):
+            checkpoint = None
+
+    if checkpoint is not None:
+        start = checkpoint['offset']
+        binary_dict = is_binary_dictionary(dict_file_path)
+        hash_to_word = read_dictionary_from_file(dict_file_path)
+        hash_to_word.fork_suffixes.update(checkpoint['fork_suffixes'])
+        word_pool.restore(checkpoint['word_pool'])
+    else:
+        start = 0
+        hash_to_word = initial_hash_to_word.copy() if isinstance(initial_hash_to_word, HashToWord) else HashToWord(initial_hash_to_word)
+    known_hashes = len(hash_to_word) if checkpoint is not None else 0
+    known_collisions = len(hash_to_word.collisions) if checkpoint is not None else 0
+    end = find_last_line_end(input_path, start)
+    ranges = split_file(input_path, chunk_size, start, end)
+
+    scanner = get_scanner(strip_control_chars=True)
+    state = ScanState()
+    for range_start, range_end in ranges:
+        scanner.scan(read_text_range(input_path, range_start, range_end), state)
+    hash_to_word = build_dictionary(state, hash_to_word)
+    report_dictionary(hash_to_word)
+
+    mode = 'a' if checkpoint is not None else 'w'
+    output_file = sys.stdout if output_path == '-' else open(output_path, mode)
+    dot_file = reopen_dot_file(dot_file_path) if checkpoint is not None else open(dot_file_path, 'w')
+    try:
+        if checkpoint is None:
+            write_dot_header(dot_file)
+        for range_start, range_end in ranges:
+            modified_chunk, edges = scanner.rewrite(read_text_range(input_path, range_start, range_end), hash_to_word)
+            output_file.write(modified_chunk)
+            write_dot_edges(dot_file, edges)
+        write_dot_footer(dot_file)
+    finally:
+        dot_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    if binary_dict:
+        write_binary_dictionary(dict_file_path, hash_to_word)
+    else:
+        # The entries of all the hashes come first, then of all the colliding
+        # long hashes; skip the ones already written from both
+        entries = hash_to_word.entries()
+        new_entries = itertools.chain(
+            itertools.islice(entries, known_hashes, len(hash_to_word)),
+            itertools.islice(entries, known_collisions, None))
+        write_text_dictionary(dict_file_path, new_entries, mode)
+
+    write_checkpoint(checkpoint_path, {
+        'offset': end,
+        'fingerprint': file_fingerprint(input_path, end),
+        'word_pool': word_pool.state(),
+        'fork_suffixes': hash_to_word.fork_suffixes,
+    })
+    return hash_to_word
+
+class Reverser:
+    """Restores the hashes of the words of a dictionary: the full hash where
+    it is known, the short hash otherwise. Words are only replaced as whole
+    words. The content is tokenized by a single regex matching the tokens
+    that can be words (made of the letters the words start with and contain),
+    and every token is looked up in a dict, so the time is linear in the size
+    of the content whatever the number of words.
+
+    Words that are also LOG_WORDS (e.g. DEBUG in a dictionary written before
+    they were left out of the word table) cannot be told apart from the log
+    text, so they are not restored, with a warning."""
+    def __init__(self, hash_to_word, file=None):
+        if not isinstance(hash_to_word, HashToWord):
+            hash_to_word = HashToWord(hash_to_word)
+        self.word_to_hash = {}
+        for h, word in hash_to_word.entries():
+            self.word_to_hash.setdefault(word, h)
+        self.log_words = sorted(word for word in self.word_to_hash if word in LOG_WORDS)
+        for word in self.log_words:
+            del self.word_to_hash[word]
+        if self.log_words:
+            print(f"warning: not restoring {len(self.log_words)} dictionary words that are also log words: {', '.join(self.log_words)}",
+                  file=file or sys.stderr)
+
+        token_pattern = word_token_pattern(self.word_to_hash)
+        self.token_pattern = re.compile(token_pattern) if token_pattern else None
+
+    def replace_token(self, match):
+        token = match.group()
+        return self.word_to_hash.get(token, token)
+
+    def reverse(self, content):
+        """Replace the words in the content with their hashes."""
+        if self.token_pattern is None:
+            return content
+        if stage_stats is None:
+            return self.token_pattern.sub(self.replace_token, content)
+        started = time.perf_counter()
+        reversed_content, replacements = self.token_pattern.subn(self.replace_token, content)
+        add_stats('reverse', started, len(content), replacements)
+        return reversed_content
+
+def process_reverse(input_path, output_path, hash_to_word, chunk_size=STREAM_CHUNK_SIZE):
+    """Restore the hashes of a dehashed log (or an excerpt of it) from its
+    dictionary. Either path can be '-' for stdin/stdout. The input is read
+    once, in chunks of whole lines."""
+    reverser = Reverser(hash_to_word)
+    input_file = sys.stdin if input_path == '-' else open_log(input_path, 'r')
+    output_file = sys.stdout if output_path == '-' else open_log(output_path, 'w')
+    try:
+        for chunk in read_chunks(input_file, chunk_size):
+            output_file.write(reverser.reverse(chunk))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+class Dehasher:
+    """Dehashes lines one by one as they come, e.g. from a live log, with its
+    own dictionary, word pool and replacement rules, so several dehashers can
+    run in one process without sharing any state. The rules default to (a
+    copy of) the predefined rules and the dictionary to (a copy of) the
+    initial dictionary.
+
+    Words are assigned to the new hashes of every line as it is fed, so a
+    hash keeps the word it got when it was first seen, even if a later line
+    would have made it a BLOCK, like in process_incremental. Lines with no
+    hash are only stripped of control characters.
+
+    If new_entries is set to a list, the (hash, word) entries of the words
+    assigned by feed are appended to it, to be appended to a text dictionary
+    file, see process_follow. An entry whose full hash only became known
+    later is appended again, with it."""
+    def __init__(self, initial_hash_to_word=None, rules=None, seed=None, namespace=None):
+        if initial_hash_to_word is None:
+            initial_hash_to_word = HashToWord()
+        self.hash_to_word = initial_hash_to_word.copy() if isinstance(initial_hash_to_word, HashToWord) else HashToWord(initial_hash_to_word)
+        self.rules = list(specific_replacements if rules is None else rules)
+        self.word_pool = WordPool(seed, namespace)
+        self.scanner = Scanner(self.rules, strip_control_chars=True)
+        self.block_tree = BlockTree()
+        self.new_entries = None
+
+    def feed(self, line):
+        """Dehash the line (or a few whole lines) and return it."""
+        if '0x' not in line:
+            return control_chars_regex.sub('', line)
+        state = ScanState(self.rules)
+        line = self.scanner.scan(line, state)
+        # Most lines only have known hashes, the hashes of the rule matches
+        # are among the hashes of the line
+        hash_to_word = self.hash_to_word
+        new_hashes = [h for h in state.short_hashes if h not in hash_to_word]
+        new_collisions = False
+        for h, full_hash in itertools.chain(state.long_hashes.items(), ((h, full_hash) for full_hash, h in state.colliding_hashes.items())):
+            known_full_hash = hash_to_word.full_hash(h)
+            if known_full_hash is None:
+                new_hashes.append(h)
+            elif known_full_hash != full_hash and full_hash not in hash_to_word.collisions:
+                new_collisions = True
+        if new_hashes or new_collisions:
+            known_collisions = len(hash_to_word.collisions)
+            build_dictionary(state, hash_to_word, self.rules, self.word_pool)
+            if self.new_entries is not None:
+                self.add_new_entries(new_hashes, known_collisions)
+        line, edges = self.scanner.rewrite(line, self.hash_to_word)
+        if edges:
+            self.block_tree.add_edges(edges)
+        return line
+
+    def add_new_entries(self, new_hashes, known_collisions):
+        hash_to_word = self.hash_to_word
+        for h in dict.fromkeys(new_hashes):
+            full_hash = hash_to_word.full_hash(h)
+            self.new_entries.append(('0x' + full_hash.hex() if full_hash is not None else h, hash_to_word[h]))
+        if len(hash_to_word.collisions) > known_collisions:
+            collisions = list(hash_to_word.collisions.items())[known_collisions:]
+            self.new_entries.extend(('0x' + full_hash.hex(), word) for full_hash, word in collisions)
+
+    def write_sidecars(self, sidecar_path, binary_dict=False, collapse_dot=False, compression=None):
+        """Write the .dict, .dot and .forks.json files of the lines fed so
+        far next to sidecar_path, like write_output."""
+        dot_file_path = sidecar_file_path(sidecar_path, ".dot", compression)
+        if collapse_dot:
+            write_collapsed_dot_file(dot_file_path, self.block_tree)
+        else:
+            with open_log(dot_file_path, 'w') as dot_file:
+                write_dot_header(dot_file)
+                write_dot_edges(dot_file, ((self.block_tree.numbers[child], parent, child) for child, parent in self.block_tree.parents.items()))
+                write_dot_footer(dot_file)
+        write_fork_stats(sidecar_file_path(sidecar_path, ".forks.json", compression), self.block_tree)
+        write_dictionary_to_file(sidecar_path, self.hash_to_word, binary=binary_dict, compression=compression)
+
+# Time (in seconds) to wait for more lines at the end of a followed log
+FOLLOW_POLL_INTERVAL = 0.2
+
+def follow_lines(file_path, poll_interval=FOLLOW_POLL_INTERVAL):
+    """Yield the lines of the file from its start and then the lines written
+    to it, like tail -f, forever. A line is only yielded once it is complete
+    (with its trailing newline). None is yielded every time the end of the
+    file is reached, before waiting for more lines, so the caller can flush
+    its output. The file is followed from its start again if it is truncated
+    or replaced, e.g. rotated."""
+    file = open(file_path, 'rb')
+    try:
+        pending = b''
+        while True:
+            line = file.readline()
+            if line.endswith(b'\n'):
+                yield (pending + line).decode(errors='replace')
+                pending = b''
+                continue
+            pending += line
+            yield None
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_ino != os.fstat(file.fileno()).st_ino or stat.st_size < file.tell()):
+                file.close()
+                file = open(file_path, 'rb')
+                pending = b''
+            else:
+                time.sleep(poll_interval)
+    finally:
+        file.close()
+
+def stop_following(signum, frame):
+    raise KeyboardInterrupt
+
+def process_follow(input_path, output_path, dehasher, sidecar_path=None, binary_dict=False, collapse_dot=False, sidecar_compression=None, poll_interval=FOLLOW_POLL_INTERVAL):
+    """Dehash the lines of the log as they are written to it with the
+    dehasher, writing them to the output ('-' for stdout), until interrupted
+    with Ctrl-C or SIGTERM. The output is flushed whenever the end of the log
+    is reached. The .dict, .dot and .forks.json files are written next to
+    sidecar_path, if given, once following stops.
+
+    A text .dict file is also kept up to date while following: the entries
+    of the new words are appended to it and flushed along with the output,
+    so the dehashed output can be reversed even if the process is killed."""
+    try:
+        previous_handler = signal.signal(signal.SIGTERM, stop_following)
+        handling_sigterm = True
+    except ValueError:
+        # not the main thread
+        handling_sigterm = False
+    output_file = sys.stdout if output_path == '-' else open_log(output_path, 'w')
+    dict_file = None
+    try:
+        if sidecar_path and not binary_dict:
+            dict_file_path = sidecar_file_path(sidecar_path, ".dict", sidecar_compression)
+            dict_file, temporary_path = open_temporary_log(dict_file_path)
+            for h, word in dehasher.hash_to_word.entries():
+                dict_file.write(dictionary_line(h, word))
+            dict_file.flush()
+            # Replaced rather than rewritten, as it may be mapped by the dictionary
+            os.replace(temporary_path, dict_file_path)
+            dehasher.new_entries = []
+        for line in follow_lines(input_path, poll_interval):
+            if line is not None:
+                output_file.write(dehasher.feed(line))
+                continue
+            output_file.flush()
+            if dict_file is not None:
+                for h, word in dehasher.new_entries:
+                    dict_file.write(dictionary_line(h, word))
+                dehasher.new_entries.clear()
+                dict_file.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if handling_sigterm:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL if previous_handler is None else previous_handler)
+        if dict_file is not None:
+            dict_file.close()
+        dehasher.new_entries = None
+        if output_file is not sys.stdout:
+            output_file.close()
+        else:
+            output_file.flush()
+
+    if sidecar_path:
+        dehasher.write_sidecars(sidecar_path, binary_dict=binary_dict, collapse_dot=collapse_dot, compression=sidecar_compression)
+    return dehasher.hash_to_word
+
+def process_file(file_path, backup, initial_hash_to_word, jobs=1, binary_dict=False, collapse_dot=False, sidecar_compression=None, mapped=False, index=False):
+    """Process the file by replacing hashes and creating backups if required.
+    The file is rewritten through a temporary file in the same directory. A
+    compressed file is rewritten compressed, by one job. If mapped is set, an
+    uncompressed file is processed as bytes, see process_mapped."""
     if backup:
         create_backup(file_path)
+    if compression_of(file_path):
+        jobs = 1
+        mapped = False
+
+    output, output_path = open_temporary_log(file_path, 'wb' if mapped else 'w')
+    try:
+        if mapped:
+            with output:
+                process_mapped(file_path, output, initial_hash_to_word, sidecar_path=file_path, jobs=jobs, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+        else:
+            with open_log(file_path, 'r') as file, output:
+                dehash(file, output, initial_hash_to_word, sidecar_path=log_base_path(file_path), jobs=jobs, binary_dict=binary_dict,
+                       collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+    except BaseException:
+        os.unlink(output_path)
+        raise
+
+    shutil.copymode(file_path, output_path)
+    os.replace(output_path, file_path)
+
+def process_path(input_path, output_path, initial_hash_to_word, sidecar_path=None, jobs=1, binary_dict=False, collapse_dot=False, sidecar_compression=None, mapped=False, index=False):
+    """Dehash input_path into output_path. Either of them can be '-' for
+    stdin/stdout, and be compressed (a compressed input is processed by one
+    job). If mapped is set, an uncompressed input file is processed as bytes,
+    see process_mapped. The .dict and .dot files default to the output file."""
+    if sidecar_path is None and output_path != '-':
+        sidecar_path = log_base_path(output_path)
+    if compression_of(input_path):
+        jobs = 1
+        mapped = False
+
+    if mapped and input_path != '-':
+        if output_path == '-':
+            sys.stdout.flush()
+            process_mapped(input_path, sys.stdout.buffer, initial_hash_to_word, sidecar_path=sidecar_path, jobs=jobs, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+            sys.stdout.buffer.flush()
+        else:
+            with open_log(output_path, 'wb') as output_file:
+                process_mapped(input_path, output_file, initial_hash_to_word, sidecar_path=sidecar_path, jobs=jobs, binary_dict=binary_dict, collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+        return
+
+    input_file = spool_stream(sys.stdin) if input_path == '-' else open_log(input_path, 'r')
+    with input_file:
+        if output_path == '-':
+            dehash(input_file, sys.stdout, initial_hash_to_word, sidecar_path=sidecar_path, jobs=jobs, binary_dict=binary_dict,
+                   collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+        else:
+            with open_log(output_path, 'w') as output_file:
+                dehash(input_file, output_file, initial_hash_to_word, sidecar_path=sidecar_path, jobs=jobs, binary_dict=binary_dict,
+                       collapse_dot=collapse_dot, sidecar_compression=sidecar_compression, index=index)
+
+def expand_paths(patterns):
+    """Expand the glob patterns among the paths (for quoted patterns or shells
+    that do not expand them). A pattern matching nothing is kept as is."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+        paths.extend(matches or [pattern])
+    return paths
 
-    with open(file_path, 'r') as file:
-        content = remove_control_chars(file.read())
+def node_names(paths):
+    """Names of the nodes whose logs are at the paths: the file names, or the
+    paths if the file names are not unique."""
+    names = [os.path.basename(path) for path in paths]
+    return names if len(set(names)) == len(names) else list(paths)
 
-    modified_content, hash_to_word = replace_hashes(content, initial_hash_to_word)
+def batch_chunks(input_paths, chunk_size=PARALLEL_CHUNK_SIZE):
+    """Yield (index, chunk) pairs for the chunks of all the logs, in order.
+    The chunks of a log are (path, start, end) byte ranges ending at line
+    boundaries; a compressed log can only be read from its start, so its
+    chunks are read here, as text."""
+    for index, input_path in enumerate(input_paths):
+        if compression_of(input_path):
+            with open_log(input_path, 'r') as input_file:
+                for chunk in read_chunks(input_file, chunk_size):
+                    yield index, chunk
+        else:
+            for start, end in split_file(input_path, chunk_size):
+                yield index, (input_path, start, end)
 
-    with open(file_path, 'w') as file:
-        file.write(modified_content)
+def process_batch(input_paths, output_paths, initial_hash_to_word, sidecar_path, jobs=1, binary_dict=False, collapse_dot=False, chunk_size=PARALLEL_CHUNK_SIZE, sidecar_compression=None, index=False):
+    """Dehash the logs of several nodes with one dictionary, so a hash gets the
+    same word (e.g. a block is BLOCK42) in all of them. The logs are split at
+    line boundaries and all their chunks are scanned, then rewritten, by jobs
+    worker processes, so the reading of one log overlaps with the scanning of
+    others. The dictionary is built from the scan results merged in the order
+    of the logs, as if they were one log. Every log is written to its output
+    path (which can be the input path) through a temporary file. The shared
+    .dict file, a .dot file with the block trees of all the nodes and a
+    .forks.json file with the fork stats of every node and of the combined
+    tree are written next to sidecar_path. If index is set, the .idx index
+    of every log is written next to it, see WordIndexBuilder."""
+    rules = list(specific_replacements)
+    recording_stats = stage_stats is not None
+    scanner = get_scanner(strip_control_chars=True)
 
-    write_dictionary_to_file(file_path, hash_to_word)        
-    write_dot_file(modified_content, file_path)
+    state = ScanState()
+    if jobs > 1:
+        with multiprocessing.Pool(jobs, init_worker, (None, rules, None, recording_stats)) as pool:
+            for chunk_state in merge_worker_stats(ordered_imap(pool, scan_batch_chunk, batch_chunks(input_paths, chunk_size), 2 * jobs)):
+                state.merge(chunk_state)
+    else:
+        for log_index, chunk in batch_chunks(input_paths, chunk_size):
+            scanner.scan(read_batch_chunk(chunk), state)
+
+    hash_to_word = build_dictionary(state, initial_hash_to_word)
+    report_dictionary(hash_to_word)
+
+    block_trees = [BlockTree() for _ in input_paths]
+    words = word_set(hash_to_word) if index else None
+    index_builders = [WordIndexBuilder(words) if index else None for _ in input_paths]
+    temporary_paths = []
+    with contextlib.ExitStack() as stack:
+        try:
+            output_files = []
+            for output_path in output_paths:
+                output_file, temporary_path = open_temporary_log(output_path)
+                temporary_paths.append(temporary_path)
+                output_files.append(stack.enter_context(output_file))
+            if jobs > 1:
+                pool = stack.enter_context(multiprocessing.Pool(jobs, init_worker, (None, rules, hash_to_word, recording_stats)))
+                rewritten_chunks = merge_worker_stats(ordered_imap(pool, rewrite_batch_chunk, batch_chunks(input_paths, chunk_size), 2 * jobs))
+            else:
+                rewritten_chunks = ((log_index, scanner.rewrite(read_batch_chunk(chunk), hash_to_word)) for log_index, chunk in batch_chunks(input_paths, chunk_size))
+            for log_index, (modified_chunk, edges) in rewritten_chunks:
+                output_files[log_index].write(modified_chunk)
+                block_trees[log_index].add_edges(edges)
+                if index:
+                    index_builders[log_index].add(modified_chunk)
+        except BaseException:
+            stack.close()
+            for temporary_path in temporary_paths:
+                os.unlink(temporary_path)
+            raise
+
+    for input_path, output_path, temporary_path in zip(input_paths, output_paths, temporary_paths):
+        shutil.copymode(input_path, temporary_path)
+        os.replace(temporary_path, output_path)
+    if index:
+        for output_path, index_builder in zip(output_paths, index_builders):
+            index_builder.write(log_base_path(output_path) + ".idx")
+
+    names = node_names(input_paths)
+    block_tree = write_batch_dot_file(sidecar_file_path(sidecar_path, ".dot", sidecar_compression), names, block_trees, collapse_dot=collapse_dot)
+    with open_log(sidecar_file_path(sidecar_path, ".forks.json", sidecar_compression), 'w') as fork_stats_file:
+        json.dump({
+            'combined': block_tree.fork_stats(),
+            'nodes': {name: node_tree.fork_stats() for name, node_tree in zip(names, block_trees)},
+        }, fork_stats_file, indent=2)
+    write_dictionary_to_file(sidecar_path, hash_to_word, binary=binary_dict, compression=sidecar_compression)
+    return hash_to_word
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Replace hashes in the log file with words.')
-    parser.add_argument('file', type=str, help='Path to the log file.')
+    parser.add_argument('file', type=str, nargs='*', help="Path to the log file, '-' reads the standard input. Several files (or glob patterns) are dehashed together with one dictionary.")
     parser.add_argument('-b', '--backup', action='store_true', help='Create a backup of the original file.')
     parser.add_argument('-d', '--dict-file', type=str, help='Dictionary file name', required=False)
+    parser.add_argument('-r', '--rules', type=str, action='append', default=[], help='Add the replacement rules of this JSON file (can be repeated).')
+    parser.add_argument('-o', '--output', type=str, help="Write the dehashed log to this file instead of rewriting the input in place, '-' writes to the standard output. With several files, the directory to write the dehashed logs to.", required=False)
+    parser.add_argument('-s', '--sidecar', type=str, help='Base path of the .dict and .dot files (defaults to the output file, with several files to "batch" in the output directory).', required=False)
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes used to scan and rewrite the log.')
+    parser.add_argument('--seed', type=int, help='Seed the shuffle of the generated words, so runs are reproducible.', required=False)
+    parser.add_argument('-i', '--incremental', action='store_true', help='Only process the lines appended since the previous run and append them to the output (requires -o).')
+    parser.add_argument('-n', '--namespace', type=str, help='Derive the word of every hash from the hash and this namespace, so it is the same in every run.', required=False)
+    parser.add_argument('--binary-dict', action='store_true', help='Write the .dict file in the binary format, which is memory-mapped when read back with -d.')
+    parser.add_argument('--convert-dict', type=str, nargs=2, metavar=('SOURCE', 'TARGET'), help='Convert a text dictionary file to the binary format or back, and exit.')
+    parser.add_argument('--reverse', action='store_true', help='Restore the hashes of a dehashed log from the dictionary given with -d, writing to -o or the standard output.')
+    parser.add_argument('--index', action='store_true', help='Write a .idx index of the lines where every word appears in the dehashed log, for --lookup.')
+    parser.add_argument('--lookup', type=str, action='append', metavar='WORD', help='Print the lines of the dehashed log (the file) where the word appears, using its .idx index (can be repeated), and exit.')
+    parser.add_argument('-f', '--follow', action='store_true', help='Keep dehashing the lines written to the log file, like tail -f, writing to -o or the standard output, until interrupted.')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the log and process it as UTF-8 bytes without decoding it (uncompressed log files only).')
+    parser.add_argument('--compress-sidecars', type=str, choices=COMPRESSIONS, help='Compress the .dict, .dot and .forks.json files with gzip, xz or zstd.', required=False)
+    parser.add_argument('--collapse-dot', action='store_true', help='Fold the linear runs of blocks in the .dot file, keeping only the forks and the ends of the chains.')
+    parser.add_argument('--profile', action='store_true', help='Print the time, size and match counts of every stage to the standard error.')
+    parser.add_argument('--stats', type=str, help='Write the time, size and match counts of every stage as JSON to this file.', required=False)
+    parser.add_argument('--build-word-table', action='store_true', help='Build the word table from the nltk words corpus, downloading it if needed, and exit.')
     args = parser.parse_args()
 
-    initial_hash_to_word = {}
+    if args.build_word_table:
+        write_word_table(word_table_path(), build_word_table(download=True))
+        print(f"word table written to {word_table_path()}")
+        sys.exit(0)
+    if args.convert_dict:
+        convert_dictionary(*args.convert_dict)
+        sys.exit(0)
+    if not args.file:
+        parser.error("the following arguments are required: file")
+    paths = expand_paths(args.file)
+    if args.lookup and compression_of(paths[0]):
+        parser.error("--lookup needs an uncompressed log")
+    if args.index and any(compression_of(path) for path in ([args.output] if args.output and len(paths) == 1 else paths)):
+        parser.error("--index cannot be used with compressed output logs, which --lookup cannot seek in")
+    if args.lookup:
+        index_path = args.sidecar + ".idx" if args.sidecar else log_base_path(paths[0]) + ".idx"
+        for word in args.lookup:
+            print_lookup(paths[0], index_path, word)
+        sys.exit(0)
+    if len(paths) > 1 and (args.reverse or args.incremental or args.follow or args.mmap or '-' in paths or args.output == '-'):
+        parser.error("several files cannot be used with --reverse, --incremental, --follow, --mmap or the standard input or output")
+    if args.compress_sidecars and args.binary_dict:
+        parser.error("--compress-sidecars cannot be used with --binary-dict, binary dictionaries are memory-mapped")
+    for rules_path in args.rules:
+        load_rules(rules_path)
+
+    if args.seed is not None or args.namespace is not None:
+        seed_words(args.seed, args.namespace)
+
+    initial_hash_to_word = HashToWord()
     if args.dict_file:
         initial_hash_to_word = read_dictionary_from_file(args.dict_file)
 
-    process_file(args.file, args.backup, initial_hash_to_word)
+    with contextlib.ExitStack() as stack:
+        if args.profile or args.stats:
+            stats = stack.enter_context(record_stats())
+        if len(paths) > 1:
+            output_dir = args.output or os.path.dirname(paths[0])
+            if args.output:
+                os.makedirs(output_dir, exist_ok=True)
+            elif args.backup:
+                for path in paths:
+                    create_backup(path)
+            output_paths = [os.path.join(output_dir, os.path.basename(path)) if args.output else path for path in paths]
+            if len(set(map(os.path.abspath, output_paths))) < len(output_paths):
+                parser.error("the files must have different names to be written to one directory")
+            process_batch(paths, output_paths, initial_hash_to_word, args.sidecar or os.path.join(output_dir, "batch"),
+                          jobs=args.jobs, binary_dict=args.binary_dict, collapse_dot=args.collapse_dot,
+                          sidecar_compression=args.compress_sidecars, index=args.index)
+        elif args.follow:
+            if paths[0] == '-' or compression_of(paths[0]):
+                parser.error("--follow needs an uncompressed log file")
+            if args.reverse or args.incremental or args.index or args.mmap:
+                parser.error("--follow cannot be used with --reverse, --incremental, --index or --mmap")
+            output_path = args.output or '-'
+            sidecar_path = args.sidecar or (log_base_path(output_path) if output_path != '-' else None)
+            process_follow(paths[0], output_path, Dehasher(initial_hash_to_word, seed=args.seed, namespace=args.namespace),
+                           sidecar_path=sidecar_path, binary_dict=args.binary_dict, collapse_dot=args.collapse_dot,
+                           sidecar_compression=args.compress_sidecars)
+        elif args.reverse:
+            if not args.dict_file:
+                parser.error("--reverse needs the dictionary file (-d)")
+            process_reverse(paths[0], args.output or '-', initial_hash_to_word)
+        elif args.incremental:
+            if paths[0] == '-' or not args.output:
+                parser.error("--incremental needs a log file and -o")
+            if args.collapse_dot:
+                parser.error("--collapse-dot cannot be used with --incremental")
+            if compression_of(paths[0]) or compression_of(args.output) or args.compress_sidecars:
+                parser.error("compressed files cannot be used with --incremental")
+            if args.index:
+                parser.error("--index cannot be used with --incremental")
+            process_incremental(paths[0], args.output, initial_hash_to_word, sidecar_path=args.sidecar, binary_dict=args.binary_dict)
+        elif paths[0] == '-' or args.output:
+            process_path(paths[0], args.output or '-', initial_hash_to_word, sidecar_path=args.sidecar, jobs=args.jobs, binary_dict=args.binary_dict,
+                         collapse_dot=args.collapse_dot, sidecar_compression=args.compress_sidecars, mapped=args.mmap, index=args.index)
+        else:
+            process_file(paths[0], args.backup, initial_hash_to_word, jobs=args.jobs, binary_dict=args.binary_dict,
+                         collapse_dot=args.collapse_dot, sidecar_compression=args.compress_sidecars, mapped=args.mmap, index=args.index)
+
+        if args.profile:
+            print(stats.table(), file=sys.stderr)
+        if args.stats:
+            with open(args.stats, 'w') as stats_file:
+                json.dump(stats.to_json(), stats_file, indent=2)
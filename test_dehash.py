@@ -1,10 +1,28 @@
 import unittest
 import re
+import io
+import os
+import tempfile
+import json
+import signal
+import threading
+import unittest.mock
+import dehash
 from dehash import (
     add_specific_replacement, specific_replacements,
     filter_and_findall, replace_matches_in_place,
-    generate_word, generate_short_hash, replace_hashes, append_word_to_dictionary
+    generate_word, generate_short_hash, replace_hashes, append_word_to_dictionary,
+    process_stream, process_file, get_scanner, ScanState,
+    process_parallel, seed_words, HashToWord,
+    WordTable, WordPool, write_word_table, read_word_table,
+    process_incremental, read_dictionary_from_file,
+    write_dictionary_to_file, MappedDictionary, convert_dictionary, record_stats,
+    load_rules, RuleMatcher, BlockTree, Reverser, process_reverse, process_batch,
+    process_path, open_log, build_dictionary, WordIndexBuilder, write_word_index, lookup_word, print_lookup,
+    Dehasher, follow_lines, word_pool, Scanner, BytesScanner, LOG_WORDS, word_set, process_follow, read_rules,
+    get_word_table
 )
+from bench_dehash import generate_log, parse_size, time_stages
 
 # How to run:
 # python3 ./test_dehash.py TestScript.test_filter_and_findall
@@ -236,5 +254,743 @@ class TestSpecificReplacement(unittest.TestCase):
         modified_content, hash_to_word = replace_hashes(some_content, {})
         self.assertIn('XBLOCK1234', modified_content)
 
+class TestScanner(unittest.TestCase):
+    def setUp(self):
+        self.content = """\x1b[2m2024-06-11 21:52:15.129\x1b[0m  INFO substrate: 🏆 Imported #1 (0xdf18…c4ac → 0x0626…a11a)
+2024-06-11 21:52:15.129  INFO txpool: event:NewBestBlock { hash: 0x0626c20236b05022c206363171118c7881fc8b0cd8d0b4f6d155f3dc6919a11a }
+2024-06-11 21:52:18.007  INFO substrate: 🏆 Imported #2 (0x0626…a11a → 0x028d…8955) Imported #3 (0x028d…8955 → 0x7684…949b)"""
+
+    def test_scan(self):
+        state = ScanState()
+        content = get_scanner(strip_control_chars=True).scan(self.content, state)
+        self.assertTrue(content.startswith("2024-06-11 21:52:15.129  INFO"))
+        self.assertEqual(list(state.long_hashes), ["0x0626…a11a"])
+        self.assertEqual(list(state.short_hashes), ["0xdf18…c4ac", "0x0626…a11a", "0x028d…8955", "0x7684…949b"])
+        rule_index = next(index for index, rule in enumerate(specific_replacements) if rule[0].startswith(".*substrate:"))
+        self.assertEqual(state.rule_matches[rule_index], {"0x0626…a11a": "1", "0x028d…8955": "2"})
+
+    def test_rewrite(self):
+        hash_to_word = {"0xdf18…c4ac": "DIPLEX", "0x0626…a11a": "BLOCK1", "0x028d…8955": "BLOCK2", "0x7684…949b": "BLOCK3"}
+        content, edges = get_scanner(strip_control_chars=True).rewrite(self.content, hash_to_word)
+        self.assertIn("{ hash: BLOCK1 }", content)
+        self.assertIn("Imported #2 (BLOCK1 → BLOCK2) Imported #3 (BLOCK2 → BLOCK3)", content)
+        # only the first edge of a line is taken
+        self.assertEqual(edges, [(1, "DIPLEX", "BLOCK1"), (2, "BLOCK1", "BLOCK2")])
+
+    def test_regex_guards(self):
+        rules = [
+            (r"fin #(\d+) \((0x[0-9a-f]{4}…[0-9a-f]{4})\)", "FINAL", r"^fin"),
+            (r"Finalized #(\d+) at (0x[0-9a-f]{4}…[0-9a-f]{4})", "FBLOCK", r"Finalized #\d+ \(0x"),
+        ]
+        content = "start\nfin #12 (0x0626…a11a)\nFinalized #13 (0x028d…8955)\n"
+        for scanner_class, data in ((Scanner, content), (BytesScanner, content.encode())):
+            scanner = scanner_class(rules, strip_control_chars=True)
+            state = ScanState(rules)
+            scanner.scan(data, state)
+            hash_to_word = build_dictionary(state, HashToWord(), rules, WordPool(seed=1))
+            self.assertEqual(hash_to_word["0x0626…a11a"], "FINAL12")
+            rewritten = scanner.rewrite(data, hash_to_word)[0]
+            if isinstance(rewritten, bytes):
+                rewritten = rewritten.decode()
+            self.assertEqual(rewritten, f"start\nfin #12 (FINAL12)\nFinalized #13 ({hash_to_word['0x028d…8955']})\n")
+
+class TestRuleMatcher(unittest.TestCase):
+    def test_same_as_findall(self):
+        lines = [
+            "substrate: [Parachain] 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)",
+            "substrate: [Relaychain] 🆕 Imported #7 (0xde0c…c522 → 0x1111…2222) Imported #8 (0x1111…2222 → 0x3333…4444)",
+            "substrate: 🏆 Imported #22 (0x0005…6914 → 0x5555…6666)",
+            "Imported nothing",
+        ]
+        rule_indexes = [index for index, rule in enumerate(specific_replacements) if rule[2] == "Imported"]
+        matcher = RuleMatcher(specific_replacements, rule_indexes)
+        self.assertEqual([index for index, group in matcher.line_rules], rule_indexes)
+        rule_matches = [{} for _ in specific_replacements]
+        matcher.find(lines, rule_matches)
+        for index in rule_indexes:
+            expected = {}
+            for line in lines:
+                for number, h in re.findall(specific_replacements[index][0], line):
+                    expected.setdefault(h, number)
+            self.assertEqual(rule_matches[index], expected)
+        self.assertEqual(rule_matches[1], {"0x0005…6914": "21", "0x1111…2222": "7"})
+
+    def test_load_rules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rules_path = os.path.join(directory, "rules.json")
+            with open(rules_path, 'w') as rules_file:
+                rules_file.write(r"""[{"pattern": ".*finality:...Finalized #(\\d+) \\((0x[0-9a-f]{4}…[0-9a-f]{4})\\)", "replacement": "FINAL", "guard": "Finalized"}]""")
+            try:
+                load_rules(rules_path)
+                modified_content, hash_to_word = replace_hashes("finality: 🎯 Finalized #12 (0x0626…a11a)\n", {})
+            finally:
+                specific_replacements.pop()
+            self.assertEqual(modified_content, "finality: 🎯 Finalized #12 (FINAL12)\n")
+
+            with open(rules_path, 'w') as rules_file:
+                rules_file.write('[{"pattern": "Finalized", "replacement": "FINAL", "guard": "Finalized"}]')
+            with self.assertRaises(ValueError):
+                load_rules(rules_path)
+
+            for guard in ("^finality", r"Finalized #\d+ \(0x", "at 0"):
+                with open(rules_path, 'w') as rules_file:
+                    json.dump([{"pattern": r"Finalized #(\d+) (0x[0-9a-f]{64})", "replacement": "FINAL", "guard": guard}], rules_file)
+                with self.assertRaisesRegex(ValueError, "plain text"):
+                    load_rules(rules_path)
+            self.assertNotIn("FINAL", [rule[1] for rule in specific_replacements])
+
+    def test_overlapping_guards(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rules_path = os.path.join(directory, "rules.json")
+            with open(rules_path, 'w') as rules_file:
+                json.dump([
+                    {"pattern": r".*cumulus: Imported #(\d+) \(0x[0-9a-f]{4}…[0-9a-f]{4} → (0x[0-9a-f]{4}…[0-9a-f]{4})\)",
+                     "replacement": "PARA", "guard": "Imported #"},
+                    {"pattern": r"add_block: (\d+) (0x[0-9a-f]{64})", "replacement": "TXBLOCK", "guard": "block"},
+                ], rules_file)
+            rules = specific_replacements + read_rules(rules_path)
+        long_hash = "0x" + "ab" * 32
+        content = ("cumulus: Imported #9 (0x1111…2222 → 0x3333…4444)\n"
+                   "substrate: 🏆 Imported #22 (0x0005…6914 → 0x5555…6666)\n"
+                   f"pool: add_block: 5 {long_hash}\n")
+        for scanner_class, data in ((Scanner, content), (BytesScanner, content.encode())):
+            scanner = scanner_class(rules, strip_control_chars=True)
+            self.assertNotIn("Imported #", scanner.guard_index_by_text)
+            state = ScanState(rules)
+            scanner.scan(data, state)
+            hash_to_word = build_dictionary(state, HashToWord(), rules, WordPool(seed=1))
+            self.assertEqual(hash_to_word["0x3333…4444"], "PARA9")
+            self.assertEqual(hash_to_word["0x5555…6666"], "BLOCK22")
+            self.assertEqual(hash_to_word[generate_short_hash(long_hash)], "TXBLOCK5")
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.content = """2024-06-11 21:53:30.006  INFO tokio-runtime-worker substrate: 🏆 Imported #20 (0xdb4b…bd58 → 0xde0c…c522)
+2024-06-11 21:53:31.007  INFO tokio-runtime-worker txpool: \x1b[32mmaintain\x1b[0m event:NewBestBlock { hash: 0xde0c6c20236b05022c206363171118c7881fc8b0cd8d0b4f6d155f3dc691c522 }
+2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:53:33.007  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0xdcd3…b73c)
+"""
+        self.expected = """2024-06-11 21:53:30.006  INFO tokio-runtime-worker substrate: 🏆 Imported #20 (DIPLEX → BLOCK20)
+2024-06-11 21:53:31.007  INFO tokio-runtime-worker txpool: maintain event:NewBestBlock { hash: BLOCK20 }
+2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (BLOCK20 → BLOCK21)
+2024-06-11 21:53:33.007  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (BLOCK20 → BLOCK21f01)
+"""
+
+    def test_process_stream(self):
+        append_word_to_dictionary("DIPLEX")
+        output = io.StringIO()
+        # tiny chunks, so the log is processed a line at a time
+        hash_to_word = process_stream(io.StringIO(self.content), output, {}, chunk_size=10)
+        self.assertEqual(output.getvalue(), self.expected)
+        self.assertEqual(hash_to_word["0xdcd3…b73c"], "BLOCK21f01")
+
+    def test_process_file(self):
+        append_word_to_dictionary("DIPLEX")
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "log.txt")
+            with open(file_path, 'w') as file:
+                file.write(self.content)
+            process_file(file_path, True, {})
+            with open(file_path) as file:
+                self.assertEqual(file.read(), self.expected)
+            with open(file_path + ".bak") as file:
+                self.assertEqual(file.read(), self.content)
+            with open(file_path + ".dict") as file:
+                self.assertIn("0xdcd3…b73c: BLOCK21f01\n", file.read())
+            with open(file_path + ".dot") as file:
+                self.assertIn('"BLOCK21f01" -> "BLOCK20";', file.read())
+
+class TestBlockTree(unittest.TestCase):
+    def setUp(self):
+        self.block_tree = BlockTree()
+        edges = [(number, f"B{number - 1}", f"B{number}") for number in range(1, 7)]
+        edges += [(6, "B5", "B6a"), (7, "B6a", "B7")] + [(number, f"B{number - 1}", f"B{number}") for number in range(8, 11)]
+        self.block_tree.add_edges(edges)
+
+    def test_fork_stats(self):
+        fork_stats = self.block_tree.fork_stats()
+        self.assertEqual(fork_stats['blocks'], 12)
+        self.assertEqual(fork_stats['tips'], ["B10"])
+        self.assertEqual(fork_stats['forks'], 1)
+        self.assertEqual(fork_stats['fork_blocks'], 1)
+        self.assertEqual(fork_stats['fork_points'], [{'number': 5, 'block': "B5", 'children': ["B6", "B6a"], 'depth': 1}])
+        self.assertEqual(fork_stats['reorgs'], [{'number': 7, 'block': "B7", 'previous_tip': "B6", 'ancestor': "B5", 'depth': 1}])
+
+    def test_collapsed_edges(self):
+        edges = set(self.block_tree.collapsed_edges(context=1))
+        self.assertEqual(edges, {("B4", "B0", 3), ("B5", "B4", 0), ("B6", "B5", 0), ("B6a", "B5", 0), ("B10", "B6a", 3)})
+
+class TestBatch(unittest.TestCase):
+    alice = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #20 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:53:34.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0x0005…6914 → 0xdcd3…b73c)
+"""
+    bob = """2024-06-11 21:53:33.105  INFO tokio-runtime-worker substrate: 🏆 Imported #20 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:53:34.105  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0x0005…6914 → 0x3b1f…09a2)
+2024-06-11 21:53:35.105 DEBUG tokio-runtime-worker txpool: [0x5064…652d] propagated
+"""
+
+    def tearDown(self):
+        seed_words(None)
+
+    def process(self, jobs):
+        seed_words(1)
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, content in (("alice.log", self.alice), ("bob.log", self.bob)):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], 'w') as file:
+                    file.write(content)
+            sidecar_path = os.path.join(directory, "batch")
+            process_batch(paths, paths, HashToWord(), sidecar_path, jobs, chunk_size=64)
+            outputs = []
+            for path in paths + [sidecar_path + ".dot"]:
+                with open(path) as file:
+                    outputs.append(file.read())
+            return outputs
+
+    def test_shared_dictionary(self):
+        alice, bob, dot = self.process(1)
+        parent = re.search(r"Imported #20 \((\w+) → BLOCK20\)", alice).group(1)
+        self.assertIn(f"Imported #20 ({parent} → BLOCK20)", bob)
+        self.assertIn("Imported #21 (BLOCK20 → BLOCK21)", alice)
+        self.assertIn("Imported #21 (BLOCK20 → BLOCK21f01)", bob)
+        self.assertIn(f'"BLOCK20" -> "{parent}";', dot)
+        self.assertIn('"BLOCK21" -> "BLOCK20" [label="alice.log"];', dot)
+        self.assertIn('"BLOCK21f01" -> "BLOCK20" [label="bob.log"];', dot)
+        self.assertIn('"bob.log" -> "BLOCK21f01" [style=dotted];', dot)
+
+    def test_parallel(self):
+        self.assertEqual(self.process(2)[:2], self.process(1)[:2])
+
+class TestCompression(unittest.TestCase):
+    content = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064528fea22246df948814b11da057079fc02268a6321172392e36319ff652d] submit_at
+"""
+
+    def tearDown(self):
+        seed_words(None)
+
+    def test_compressed_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            plain_path = os.path.join(directory, "node.log")
+            with open(plain_path, 'w') as file:
+                file.write(self.content)
+            seed_words(1)
+            process_path(plain_path, plain_path + ".out", HashToWord())
+            for compression in ("gz", "xz"):
+                input_path = os.path.join(directory, f"node.log.{compression}")
+                with open_log(input_path, 'w') as file:
+                    file.write(self.content)
+                output_path = os.path.join(directory, f"node.{compression}.out.{compression}")
+                seed_words(1)
+                process_path(input_path, output_path, HashToWord(), jobs=2, sidecar_compression=compression)
+                with open(plain_path + ".out") as plain, open_log(output_path) as compressed:
+                    self.assertEqual(compressed.read(), plain.read())
+                sidecar_path = os.path.join(directory, f"node.{compression}.out")
+                with open(plain_path + ".out.dict") as plain, open_log(sidecar_path + f".dict.{compression}") as compressed:
+                    self.assertEqual(compressed.read(), plain.read())
+                self.assertEqual(read_dictionary_from_file(sidecar_path + f".dict.{compression}"),
+                                 read_dictionary_from_file(plain_path + ".out.dict"))
+
+    def test_file_mode(self):
+        umask = os.umask(0o022)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "node")
+                for compression in (None, "gz"):
+                    write_dictionary_to_file(path, {"0xde0c…c522": "BLOCK20"}, compression=compression)
+                    dict_file_path = path + (f".dict.{compression}" if compression else ".dict")
+                    self.assertEqual(os.stat(dict_file_path).st_mode & 0o777, 0o644)
+        finally:
+            os.umask(umask)
+
+class TestMapped(unittest.TestCase):
+    content = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:53:34.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0xdcd3…b73c)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064528fea22246df948814b11da057079fc02268a6321172392e36319ff652d] \x1b[32mLorem\x1b[0m ipsum\x85 dol
+2024-06-11 21:52:26.048 DEBUG tokio-runtime-worker txpool: [0x5064…652d] took:122.731µs
+"""
+
+    def tearDown(self):
+        seed_words(None)
+
+    def test_bytes_scanner(self):
+        text_state = ScanState()
+        bytes_state = ScanState()
+        get_scanner(strip_control_chars=True).scan(self.content, text_state)
+        data = self.content.encode()
+        get_scanner(strip_control_chars=True, binary=True).scan(data, bytes_state)
+        self.assertEqual(bytes_state.long_hashes, text_state.long_hashes)
+        self.assertEqual(bytes_state.short_hashes, text_state.short_hashes)
+        self.assertEqual(bytes_state.rule_matches, text_state.rule_matches)
+
+        hash_to_word = build_dictionary(text_state, HashToWord())
+        text, edges = get_scanner(strip_control_chars=True).rewrite(self.content, hash_to_word)
+        self.assertEqual(get_scanner(strip_control_chars=True, binary=True).rewrite(data, hash_to_word), (text.encode(), edges))
+
+    def test_process_path(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "node.log")
+            with open(input_path, 'w') as file:
+                file.write(self.content * 3)
+            outputs = []
+            for mapped in (False, True):
+                seed_words(1)
+                output_path = os.path.join(directory, f"node.{mapped}.log")
+                process_path(input_path, output_path, HashToWord(), mapped=mapped)
+                with open(output_path) as output_file, open(output_path + ".dict") as dict_file, open(output_path + ".dot") as dot_file:
+                    outputs.append((output_file.read(), dict_file.read(), dot_file.read()))
+        self.assertEqual(outputs[1], outputs[0])
+
+class TestWordIndex(unittest.TestCase):
+    def test_lookup(self):
+        builder = WordIndexBuilder({"ABEL", "BLOCK1", "BLOCK12f01"})
+        builder.add("first ABEL\nBLOCK12 BLOCK1 ABEL ABEL\n")
+        builder.add(b"\xf0\x9f\x8f\x86 BLOCK12f01\nABELS\nABEL\n")
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, "log.idx")
+            builder.write(index_path)
+            self.assertEqual(lookup_word(index_path, "ABEL"), [(0, 0), (1, 11), (4, 58)])
+            self.assertEqual(lookup_word(index_path, "BLOCK1"), [(1, 11)])
+            self.assertEqual(lookup_word(index_path, "BLOCK12f01"), [(2, 36)])
+            self.assertEqual(lookup_word(index_path, "BLOCK12"), [])
+            write_word_index(index_path, {})
+            self.assertEqual(lookup_word(index_path, "ABEL"), [])
+
+    def test_process_path(self):
+        content = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064…652d] submit_at
+2024-06-11 21:52:26.048 DEBUG tokio-runtime-worker txpool: [0x0005…6914, 0x5064…652d] propagated
+"""
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "node.log")
+            with open(input_path, 'w') as file:
+                file.write(content)
+            output_path = os.path.join(directory, "node.dehashed.log")
+            hash_to_word = HashToWord()
+            process_path(input_path, output_path, hash_to_word, index=True)
+            output = io.StringIO()
+            print_lookup(output_path, output_path + ".idx", "BLOCK21", output)
+            with open(output_path) as file:
+                lines = file.read().splitlines()
+        self.assertEqual(output.getvalue(), f"1:{lines[0]}\n3:{lines[2]}\n")
+        with self.assertRaises(ValueError):
+            print_lookup(output_path + ".zst", output_path + ".idx", "BLOCK21", output)
+
+class TestReverse(unittest.TestCase):
+    def test_reverse(self):
+        hash_to_word = HashToWord({"0x5064…652d": "ABEL", "0xd441…6960": "BLOCK1", "0xf9b6…8cba": "BLOCK12f01"})
+        hash_to_word.add_entry("0x5869c9a4f7bace630f90928e50dc27653a2fd996abcd9e57a6b9af8642ea21d2", "BURN")
+        reverser = Reverser(hash_to_word)
+        self.assertEqual(reverser.reverse("[ABEL, BLOCK1] BLOCK12 BLOCK12f01 ABELS BURN\n"),
+                         "[0x5064…652d, 0xd441…6960] BLOCK12 0xf9b6…8cba ABELS 0x5869c9a4f7bace630f90928e50dc27653a2fd996abcd9e57a6b9af8642ea21d2\n")
+
+    def test_round_trip(self):
+        content = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064528fea22246df948814b11da057079fc02268a6321172392e36319ff652d] submit_at
+2024-06-11 21:52:26.048 DEBUG tokio-runtime-worker txpool: [0x5064…652d] propagated
+"""
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, "dehashed.log")
+            with open(output_path, 'w') as output_file:
+                process_stream(io.StringIO(content), output_file, HashToWord(), sidecar_path=output_path)
+            process_reverse(output_path, output_path + ".restored", read_dictionary_from_file(output_path + ".dict"))
+            with open(output_path + ".restored") as file:
+                restored = file.read()
+        self.assertEqual(restored, content.replace("[0x5064…652d]", "[0x5064528fea22246df948814b11da057079fc02268a6321172392e36319ff652d]"))
+
+    def test_log_words(self):
+        content = "".join(f"2024-06-11 21:52:26.{index:03d} DEBUG tokio-runtime-worker txpool: [{generate_short_hash(f'0x{index:064x}')}] submit_at\n"
+                          for index in range(2000))
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "node.log")
+            with open(log_path, 'w') as log_file:
+                log_file.write(content)
+            process_path(log_path, log_path + ".dehashed", HashToWord(), log_path)
+            hash_to_word = read_dictionary_from_file(log_path + ".dict")
+            self.assertFalse(word_set(hash_to_word) & LOG_WORDS)
+            process_reverse(log_path + ".dehashed", log_path + ".restored", hash_to_word)
+            with open(log_path + ".restored") as restored_file:
+                self.assertEqual(restored_file.read(), content)
+
+        # a dictionary giving a log word to a hash, e.g. of an older run
+        warnings = io.StringIO()
+        reverser = Reverser({"0x63bb…e6e8": "DEBUG", "0x5064…652d": "ABEL"}, file=warnings)
+        self.assertEqual(reverser.reverse("DEBUG txpool: [ABEL]\n"), "DEBUG txpool: [0x5064…652d]\n")
+        self.assertIn("DEBUG", warnings.getvalue())
+
+class TestDehasher(unittest.TestCase):
+    def test_feed(self):
+        dehasher = Dehasher(seed=1)
+        imported = dehasher.feed("2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)\n")
+        self.assertRegex(imported, r"Imported #21 \([A-Z]+ → BLOCK21\)\n$")
+        parent = re.search(r"\(([A-Z]+) →", imported).group(1)
+        self.assertEqual(dehasher.feed(f"[0xde0c1234{'0' * 52}c522] \x1b[32mready\x1b[0m\n"),
+                         f"[{parent}] ready\n")
+        self.assertEqual(dehasher.feed("best: #21 (0x0005…6914)\n"), "best: #21 (BLOCK21)\n")
+        self.assertEqual(dehasher.feed("no hashes here\n"), "no hashes here\n")
+        self.assertEqual(dehasher.hash_to_word.full_hash("0xde0c…c522"), bytes.fromhex("de0c1234" + "0" * 52 + "c522"))
+        self.assertEqual(dehasher.block_tree.parents, {"BLOCK21": parent})
+
+    def test_independent(self):
+        pool_state = word_pool.state()
+        rules = list(specific_replacements)
+        first = Dehasher(seed=1)
+        second = Dehasher({"0xde0c…c522": "ABEL"}, seed=1, rules=[(r"Finalized #(\d+) \((0x[0-9a-f]{4}…[0-9a-f]{4})\)", "FINAL", "Finalized")])
+        self.assertEqual(second.feed("Finalized #3 (0x0005…6914), after 0xde0c…c522\n"), "Finalized #3 (FINAL3), after ABEL\n")
+        self.assertNotIn("FINAL", first.feed("Finalized #3 (0x0005…6914)\n"))
+        self.assertEqual(len(first.hash_to_word), 1)
+        self.assertEqual(word_pool.state(), pool_state)
+        self.assertEqual(specific_replacements, rules)
+
+    def test_new_entries(self):
+        dehasher = Dehasher(seed=1)
+        dehasher.new_entries = []
+        dehasher.feed("[0xde0c…c522] [0x0005…6914]\n")
+        dehasher.feed("[0x0005…6914]\n")
+        long_hash = f"0xde0c{'1' * 56}c522"
+        dehasher.feed(f"[{long_hash}]\n")
+        words = dehasher.hash_to_word
+        self.assertEqual(dehasher.new_entries, [("0xde0c…c522", words["0xde0c…c522"]), ("0x0005…6914", words["0x0005…6914"]),
+                                                (long_hash, words["0xde0c…c522"])])
+
+    def test_new_colliding_entries(self):
+        first, second = f"0xabcd{'1' * 56}1234", f"0xabcd{'2' * 56}1234"
+        for lines in ([f"[{first}] [{second}]\n"], [f"[{first}]\n", f"[{second}]\n"]):
+            dehasher = Dehasher(seed=1)
+            dehasher.new_entries = []
+            for line in lines + [f"[{second}]\n"] * 3:
+                dehasher.feed(line)
+            words = dehasher.hash_to_word
+            self.assertEqual(dehasher.new_entries, [(first, words["0xabcd…1234"]), (second, words.collisions[bytes.fromhex(second[2:])])])
+
+    def test_process_follow(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "node.log")
+            output_path = os.path.join(directory, "node.dehashed.log")
+            with open(log_path, 'w') as log_file:
+                log_file.write("substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)\n")
+            # Stopped like by systemd or docker stop
+            timer = threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGTERM))
+            timer.start()
+            try:
+                process_follow(log_path, output_path, Dehasher(seed=1), sidecar_path=output_path, poll_interval=0.01)
+            finally:
+                timer.cancel()
+            with open(output_path) as output_file:
+                self.assertRegex(output_file.read(), r"^substrate: 🏆 Imported #21 \([A-Z]+ → BLOCK21\)\n$")
+            self.assertEqual(read_dictionary_from_file(output_path + ".dict")["0x0005…6914"], "BLOCK21")
+            self.assertTrue(os.path.exists(output_path + ".forks.json"))
+
+    def test_follow_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "node.log")
+            with open(log_path, 'w') as log_file:
+                log_file.write("first\nsec")
+            lines = follow_lines(log_path, poll_interval=0)
+            self.assertEqual(next(lines), "first\n")
+            self.assertIsNone(next(lines))
+            with open(log_path, 'a') as log_file:
+                log_file.write("ond\n")
+            self.assertEqual(next(lines), "second\n")
+            self.assertIsNone(next(lines))
+            # Truncated, e.g. rotated by copytruncate
+            with open(log_path, 'w') as log_file:
+                log_file.write("new\n")
+            self.assertEqual(next(lines), "new\n")
+            lines.close()
+
+class TestStats(unittest.TestCase):
+    def test_record_stats(self):
+        content = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064…652d] \x1b[32mLorem\x1b[0m ipsum dol
+"""
+        with record_stats() as stats:
+            process_stream(io.StringIO(content), io.StringIO(), {})
+        self.assertEqual(stats.stages['scan']['matches'], 3)
+        self.assertEqual(stats.stages['rules 0,1,2 (Imported)']['matches'], 1)
+        self.assertEqual(stats.stages['rule 0 (BLOCK)']['matches'], 0)
+        self.assertEqual(stats.stages['rule 1 (RBLOCK)']['matches'], 0)
+        self.assertEqual(stats.stages['rule 2 (BLOCK)']['matches'], 1)
+        self.assertEqual(stats.stages['rule words']['matches'], 1)
+        self.assertEqual(stats.stages['words']['matches'], 2)
+        self.assertEqual(stats.stages['rewrite']['matches'], 2)
+        self.assertIn('control chars', stats.stages)
+        self.assertIn('rules 0,1,2 (Imported)', stats.table())
+
+class TestWordTable(unittest.TestCase):
+    def test_write_read(self):
+        buckets = {4: "ABELFADESTAR", 5: "BURNS"}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache", "words.tbl")
+            write_word_table(path, buckets)
+            self.assertEqual(read_word_table(path), buckets)
+
+    def test_word(self):
+        table = WordTable({4: "ABELFADESTAR"})
+        self.assertEqual(table.size(4), 3)
+        self.assertEqual(table.word(4, 1), "FADE")
+        # lengths missing from the table fall back to made-up words
+        self.assertTrue(table.size(5) > 0)
+        self.assertEqual(len(table.word(5, 0)), 5)
+
+    def test_log_words(self):
+        table = WordTable({5: "BURNSDEBUGERROR"})
+        self.assertEqual(table.size(5), 1)
+        self.assertEqual(table.word(5, 0), "BURNS")
+        # nor are they made up
+        for length in (4, 5):
+            words = {table.word(length, index) for index in range(table.size(length))}
+            self.assertFalse(words & LOG_WORDS)
+
+    def test_missing_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "words.tbl")
+            with unittest.mock.patch.dict(os.environ, {"DEHASH_WORD_TABLE": path}), \
+                    unittest.mock.patch("dehash.build_word_table", side_effect=LookupError) as build, \
+                    unittest.mock.patch("dehash.word_table", None):
+                self.assertEqual(len(get_word_table().word(4, 0)), 4)
+                self.assertEqual(read_word_table(path), {})
+                # the miss is remembered
+                dehash.word_table = None
+                self.assertEqual(len(get_word_table().word(4, 0)), 4)
+                self.assertEqual(build.call_count, 1)
+
+    def test_word_pool(self):
+        first = [WordPool(seed=3).generate() for _ in range(1)]
+        pool = WordPool(seed=3)
+        generated = [pool.generate() for _ in range(100)]
+        self.assertEqual(generated[:1], first)
+        self.assertEqual(len(set(generated)), 100)
+        pool.append("ABEL")
+        self.assertEqual(pool.generate(), "ABEL")
+
+class TestHashedWords(unittest.TestCase):
+    def tearDown(self):
+        seed_words(None)
+
+    def test_same_word_in_every_pool(self):
+        hashes = ["0x5064…652d", "0xd441…6960", "0x5869…21d2", "0xf9b6…8cba"]
+        words = [WordPool(namespace="node").generate(h) for h in hashes]
+        pool = WordPool(seed=1, namespace="node")
+        self.assertEqual([pool.generate(h) for h in reversed(hashes)], list(reversed(words)))
+
+    def test_taken_word(self):
+        pool = WordPool(namespace="node")
+        word = pool.generate("0x5064…652d")
+        other = pool.generate("0x5064…652d", taken={word})
+        self.assertNotEqual(other, word)
+
+    def test_replace_hashes(self):
+        content = "[0x5064…652d] [0xd441…6960] [0x5064528fea22246df948814b11da057079fc02268a6321172392e36319ff652d]"
+        seed_words(None, "node")
+        first, hash_to_word = replace_hashes(content, {})
+        seed_words(None, "node")
+        second, hash_to_word = replace_hashes(content, {})
+        self.assertEqual(first, second)
+        self.assertEqual(len(set(hash_to_word.values())), 2)
+
+class TestHashToWord(unittest.TestCase):
+    def test_fork_word(self):
+        hash_to_word = HashToWord({"0x0001…0001": "BLOCK21", "0x0002…0002": "BLOCK21f02"})
+        self.assertEqual(hash_to_word.fork_word("BLOCK20"), "BLOCK20")
+        hash_to_word["0x0003…0003"] = hash_to_word.fork_word("BLOCK21")
+        hash_to_word["0x0004…0004"] = hash_to_word.fork_word("BLOCK21")
+        self.assertEqual(hash_to_word["0x0003…0003"], "BLOCK21f01")
+        self.assertEqual(hash_to_word["0x0004…0004"], "BLOCK21f03")
+
+    def test_word_index(self):
+        hash_to_word = HashToWord()
+        hash_to_word["0x0001…0001"] = "ABEL"
+        hash_to_word.update({"0x0002…0002": "FADE"})
+        self.assertEqual(hash_to_word.word_to_hash, {"ABEL": "0x0001…0001", "FADE": "0x0002…0002"})
+        hash_to_word["0x0001…0001"] = "BURN"
+        del hash_to_word["0x0002…0002"]
+        self.assertEqual(hash_to_word.word_to_hash, {"BURN": "0x0001…0001"})
+
+    def test_preloaded_forks(self):
+        content = """
+2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:53:33.007  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0xdcd3…b73c)
+"""
+        initial_hash_to_word = {"0xde0c…c522": "BLOCK20", "0xaaaa…aaaa": "BLOCK21", "0xbbbb…bbbb": "BLOCK21f01"}
+        modified_content, hash_to_word = replace_hashes(content, initial_hash_to_word)
+        self.assertIn("(BLOCK20 → BLOCK21f02)", modified_content)
+        self.assertIn("(BLOCK20 → BLOCK21f03)", modified_content)
+
+class TestCollidingHashes(unittest.TestCase):
+    first = "0xabcd" + "1" * 56 + "1234"
+    second = "0xabcd" + "2" * 56 + "1234"
+    content = f"""txpool: [{first}] ValidatedPool::submit_at
+txpool: [{second}] ValidatedPool::submit_at
+txpool: [0xabcd…1234] [{first}] [{second}]
+"""
+
+    def test_replace(self):
+        modified_content, hash_to_word = replace_hashes(self.content, {})
+        lines = modified_content.splitlines()
+        first_word = lines[0][len("txpool: ["):-len("] ValidatedPool::submit_at")]
+        second_word = lines[1][len("txpool: ["):-len("] ValidatedPool::submit_at")]
+        self.assertNotEqual(first_word, second_word)
+        self.assertEqual(lines[2], f"txpool: [{first_word}] [{first_word}] [{second_word}]")
+        self.assertEqual(hash_to_word.ambiguous_short_hashes(), {"0xabcd…1234"})
+
+    def test_merge(self):
+        first_state, second_state, state = ScanState(), ScanState(), ScanState()
+        get_scanner().scan(f"[{self.second}]\n", second_state)
+        get_scanner().scan(f"[{self.first}]\n", first_state)
+        first_state.merge(second_state)
+        get_scanner().scan(f"[{self.first}]\n[{self.second}]\n", state)
+        self.assertEqual(first_state.long_hashes, state.long_hashes)
+        self.assertEqual(first_state.colliding_hashes, state.colliding_hashes)
+
+    def test_dictionary_file(self):
+        modified_content, hash_to_word = replace_hashes(self.content, {})
+        with tempfile.TemporaryDirectory() as directory:
+            for binary in (False, True):
+                path = os.path.join(directory, f"node{binary}")
+                write_dictionary_to_file(path, hash_to_word, binary)
+                read_hash_to_word = read_dictionary_from_file(path + ".dict")
+                self.assertEqual(list(read_hash_to_word.entries()), list(hash_to_word.entries()))
+                self.assertEqual(replace_hashes(self.content, read_hash_to_word)[0], modified_content)
+            # Every line starts with the short hash, the full hash comes last
+            with open(os.path.join(directory, "nodeFalse.dict")) as dict_file:
+                lines = dict_file.read().splitlines()
+            self.assertEqual(lines, [
+                f"0xabcd…1234: {hash_to_word['0xabcd…1234']}: {self.first}",
+                f"0xabcd…1234: {hash_to_word.collisions[bytes.fromhex(self.second[2:])]}: {self.second}",
+            ])
+
+class TestBinaryDictionary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "node")
+        self.hash_to_word = {"0xde0c…c522": "BLOCK20", "0x0005…6914": "ABEL", "0x5064…652d": "FADE"}
+        write_dictionary_to_file(self.path, self.hash_to_word, binary=True)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_lookup(self):
+        mapped = MappedDictionary(self.path + ".dict")
+        self.assertEqual(dict(mapped.items()), self.hash_to_word)
+        self.assertEqual(mapped["0x0005…6914"], "ABEL")
+        self.assertNotIn("0x0005…6915", mapped)
+        self.assertEqual(mapped.hash_of_word("FADE"), "0x5064…652d")
+        self.assertIsNone(mapped.hash_of_word("BURN"))
+
+    def test_replace_hashes(self):
+        content = "txpool: [0x5064…652d] [0xd441…6960] Imported #21 (0xde0c…c522 → 0x0005…6914)\n"
+        initial_hash_to_word = read_dictionary_from_file(self.path + ".dict")
+        modified_content, hash_to_word = replace_hashes(content, initial_hash_to_word)
+        self.assertIn("[FADE]", modified_content)
+        self.assertIn("(BLOCK20 → ABEL)", modified_content)
+        self.assertNotIn(hash_to_word["0xd441…6960"], ("ABEL", "FADE"))
+        self.assertEqual(len(hash_to_word), 4)
+
+    def test_same_output_dictionary(self):
+        # The text .dict of the log is written over the binary .dict it was read from
+        with open(self.path, 'w') as log_file:
+            log_file.write("txpool: [0x5064…652d] [0xd441…6960]\n")
+        process_file(self.path, False, read_dictionary_from_file(self.path + ".dict"))
+        with open(self.path) as log_file:
+            self.assertTrue(log_file.read().startswith("txpool: [FADE] ["))
+        hash_to_word = read_dictionary_from_file(self.path + ".dict")
+        self.assertNotIsInstance(hash_to_word.base, MappedDictionary)
+        self.assertEqual(len(hash_to_word), 4)
+        self.assertEqual(hash_to_word["0x0005…6914"], "ABEL")
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["node", "node.dict", "node.dot", "node.forks.json"])
+
+    def test_convert(self):
+        text_path = os.path.join(self.directory.name, "text.dict")
+        binary_path = os.path.join(self.directory.name, "binary.dict")
+        convert_dictionary(self.path + ".dict", text_path)
+        convert_dictionary(text_path, binary_path)
+        self.assertEqual(dict(read_dictionary_from_file(text_path).items()), self.hash_to_word)
+        with open(self.path + ".dict", 'rb') as first, open(binary_path, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+
+class TestIncremental(unittest.TestCase):
+    def test_append(self):
+        first = """2024-06-11 21:53:30.006  INFO tokio-runtime-worker substrate: 🏆 Imported #20 (0xdb4b…bd58 → 0xde0c…c522)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064…652d] Lorem ipsum dol
+"""
+        second = """2024-06-11 21:53:33.005  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0x0005…6914)
+2024-06-11 21:52:26.047 DEBUG tokio-runtime-worker txpool: [0x5064…652d] [0xd441…6960] Lorem ipsum dol
+"""
+        partial = "2024-06-11 21:53:33.007  INFO tokio-runtime-worker substrate: 🏆 Imported #21 (0xde0c…c522 → 0xdc"
+
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "node.log")
+            output_path = os.path.join(directory, "node.dehashed")
+            with open(log_path, 'w') as file:
+                file.write(first)
+            process_incremental(log_path, output_path, {})
+            with open(output_path) as file:
+                first_output = file.read()
+
+            with open(log_path, 'a') as file:
+                file.write(second + partial)
+            process_incremental(log_path, output_path, {})
+            with open(output_path) as file:
+                output = file.read()
+
+            self.assertTrue(output.startswith(first_output))
+            self.assertEqual(output.count("\n"), 4)
+            self.assertIn("Imported #21 (BLOCK20 → BLOCK21)", output)
+            self.assertNotIn("0xdc", output)
+
+            hash_to_word = read_dictionary_from_file(output_path + ".dict")
+            self.assertEqual(len(hash_to_word), 5)
+            self.assertEqual(len(set(hash_to_word.values())), 5)
+            with open(output_path + ".dot") as file:
+                dot = file.read()
+            self.assertTrue(dot.endswith('    "BLOCK21" -> "BLOCK20";\n}\n'))
+            self.assertEqual(dot.count("}"), 1)
+
+            # the partial line is processed once it is complete
+            with open(log_path, 'a') as file:
+                file.write("d3…b73c)\n")
+            process_incremental(log_path, output_path, {})
+            with open(output_path) as file:
+                self.assertTrue(file.read().endswith("Imported #21 (BLOCK20 → BLOCK21f01)\n"))
+
+class TestParallel(unittest.TestCase):
+    def test_same_as_serial(self):
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-imported-maintain")
+
+        seed_words(7)
+        serial = io.StringIO()
+        with open(file_path) as file:
+            serial_hash_to_word = process_stream(file, serial, {})
+
+        seed_words(7)
+        parallel = io.StringIO()
+        # small chunks, so every worker gets a few lines
+        parallel_hash_to_word = process_parallel(file_path, parallel, {}, 2, chunk_size=500)
+
+        self.assertEqual(parallel.getvalue(), serial.getvalue())
+        self.assertEqual(list(parallel_hash_to_word.items()), list(serial_hash_to_word.items()))
+
+class TestBenchmark(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("10M"), 10 << 20)
+        self.assertEqual(parse_size("1.5G"), 3 << 29)
+        self.assertEqual(parse_size("4096"), 4096)
+
+    def test_generated_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_path = os.path.join(directory, "generated.log")
+            size = generate_log(log_path, 64 << 10, seed=1)
+            self.assertGreaterEqual(size, 64 << 10)
+            stages, hashes = time_stages(log_path, directory)
+            self.assertLessEqual({'scan', 'rule words', 'words', 'rewrite', 'dictionary file'}, set(stages))
+            self.assertGreater(hashes, 0)
+            with open(os.path.join(directory, "stages.log")) as file:
+                content = file.read()
+            self.assertIn("RBLOCK", content)
+            self.assertRegex(content, r"add_block: (\d+) BLOCK\1")
+            self.assertNotRegex(content, r"0x[0-9a-f]{4}")
+
 if __name__ == '__main__':
     unittest.main()